@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# diffpy.srxplanar  by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2010-2025 Trustees of the Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# File coded by:    Xiaohao Yang
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE.txt for license information.
+#
+##############################################################################
+"""Mergeable per bin sums of integrated images."""
+
+import numpy as np
+
+
+class IntegrationAccumulator(object):
+    """Per bin sums of intensity and variance of pixels, and number of
+    pixels, accumulated over images (see Calculate.binSums).
+
+    Integration is linear, so accumulators of parts of an image series
+    (e.g. integrated by different workers or hosts) can be merged in any
+    order, and the result is the average over all pixels of all images
+    in each bin.
+    """
+
+    def __init__(self, xgrid):
+        """
+        :param xgrid: 1d array, tth or q of bins
+        """
+        self.xgrid = np.array(xgrid, dtype=float)
+        nbins = len(self.xgrid)
+        self.sums = np.zeros(nbins)
+        self.varsums = np.zeros(nbins)
+        self.counts = np.zeros(nbins)
+        self.nframes = 0
+        return
+
+    def add(self, sums, varsums, counts, nframes=1):
+        """Add the per bin sums of images.
+
+        :param sums: 1d array, sum of intensity of pixels in each bin
+        :param varsums: 1d array, sum of variance of pixels in each bin
+        :param counts: 1d array, number of pixels in each bin
+        :param nframes: int, number of images summed
+        :return: None
+        """
+        self.sums += sums
+        self.varsums += varsums
+        self.counts += counts
+        self.nframes += nframes
+        return
+
+    def merge(self, other):
+        """Add the sums of another accumulator of the same bins.
+
+        :param other: IntegrationAccumulator
+        :return: self
+        """
+        if not np.allclose(self.xgrid, other.xgrid):
+            raise ValueError("cannot merge accumulators of different bins")
+        self.add(other.sums, other.varsums, other.counts, other.nframes)
+        return self
+
+    def result(self):
+        """Get the integrated pattern of all accumulated images.
+
+        :return: 2d array, [tthorq, intensity, uncertainty], intensity
+            and variance are averaged over all pixels of all images in
+            each bin, and the variance is divided by the number of
+            images (variance of the mean), the same as integrating the
+            average image
+        """
+        counts = np.maximum(self.counts, 1)
+        intensity = self.sums / counts
+        std = np.sqrt(self.varsums / counts / max(self.nframes, 1))
+        rv = np.vstack([self.xgrid, intensity, std])
+        return rv
+
+    def save(self, filename):
+        """Save the accumulator to a .npz file.
+
+        :param filename: str, name of file
+        :return: None
+        """
+        np.savez(
+            filename,
+            xgrid=self.xgrid,
+            sums=self.sums,
+            varsums=self.varsums,
+            counts=self.counts,
+            nframes=self.nframes,
+        )
+        return
+
+    @classmethod
+    def load(cls, filename):
+        """Load an accumulator saved by self.save.
+
+        :param filename: str, name of file
+        :return: IntegrationAccumulator
+        """
+        with np.load(filename) as data:
+            rv = cls(data["xgrid"])
+            rv.add(
+                data["sums"],
+                data["varsums"],
+                data["counts"],
+                int(data["nframes"]),
+            )
+        return rv
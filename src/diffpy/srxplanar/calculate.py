@@ -13,15 +13,124 @@
 #
 ##############################################################################
 
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import scipy.ndimage.filters as snf
+import scipy.sparse as ssp
 
 from diffpy.srxconfutils.tools import _configPropertyR
+from diffpy.srxplanar.geometrycache import GeometryCache, _normalize
+
+# config options that lazily computed attributes depend on
+_xoptions = ["xdimension", "xbeamcenter", "xpixelsize", "cropedges"]
+_yoptions = ["ydimension", "ybeamcenter", "ypixelsize", "cropedges"]
+_geometryoptions = _xoptions + _yoptions + ["rotationd", "tiltd", "distance"]
+_binoptions = ["integrationspace", "tthstepd", "tthmaxd", "qstep", "qmax"]
+# config options each lazily computed attribute depends on, by name
+_lazydeps = {}
+# (number of threads, ThreadPoolExecutor) shared by all Calculate
+# instances, see _submitBlocks
+_threadpool = None
+_threadpoollock = threading.Lock()
+
+
+def _submitBlocks(func, bounds):
+    """Submit func(r0, r1) of each block of rows to the thread pool
+    shared by all Calculate instances, so that instances do not each
+    keep their own threads. The pool is replaced by a larger one if it
+    has fewer threads than blocks.
+
+    :param func: callable, func(r0, r1) processes rows r0 to r1
+    :param bounds: 1d int array, start of each block and end of last
+        block
+    :return: list of concurrent.futures.Future, of each block
+    """
+    global _threadpool
+    nthreads = len(bounds) - 1
+    with _threadpoollock:
+        if _threadpool is None or _threadpool[0] < nthreads:
+            if _threadpool is not None:
+                # blocks already submitted to it are still processed
+                _threadpool[1].shutdown(wait=False)
+            _threadpool = (nthreads, ThreadPoolExecutor(nthreads))
+        rv = [
+            _threadpool[1].submit(func, r0, r1)
+            for r0, r1 in zip(bounds[:-1], bounds[1:])
+        ]
+    return rv
+
+
+def _resetThreadPool():
+    """Forget the shared thread pool in a forked child process, where
+    its threads do not exist."""
+    global _threadpool, _threadpoollock
+    _threadpool = None
+    _threadpoollock = threading.Lock()
+    return
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_resetThreadPool)
+
+
+def _lazyProperty(deps, disk=False):
+    """Create a lazily computed attribute from a method.
+
+    The value is computed when the attribute is first accessed and
+    cached together with the values of the config options in deps. It
+    is recomputed only when one of these options changes, so a config
+    update only invalidates the attributes that depend on it. The value
+    can also be assigned, then it is cached with current option values.
+
+    :param deps: list of str, config options the value depends on,
+        including the dependencies of other attributes used to compute
+        it
+    :param disk: bool, if True, also store the value in the on-disk
+        cache (self.cache)
+    :return: property
+    """
+
+    def decorator(func):
+        name = func.__name__
+        _lazydeps[name] = deps
+
+        def getState(self):
+            return tuple(_normalize(getattr(self.config, d)) for d in deps)
+
+        def fget(self):
+            state = getState(self)
+            cached = self._lazycache.get(name)
+            if cached is not None and cached[0] == state:
+                return cached[1]
+            options = dict(zip(deps, state))
+            rv = self.cache.load(name, options) if disk else None
+            if rv is None:
+                rv = func(self)
+                if disk:
+                    self.cache.save(name, options, rv)
+            self._lazycache[name] = (state, rv)
+            return rv
+
+        def fset(self, value):
+            self._lazycache[name] = (getState(self), value)
+            return
+
+        return property(fget, fset, doc=func.__doc__)
+
+    return decorator
 
 
 class Calculate(object):
     """Provide methods for integration, variance calculation and
-    distance/Q matrix calculation etc."""
+    distance/Q matrix calculation etc.
+
+    Geometry matrices, bin edges, correction matrix and integration
+    tables are lazily computed attributes, each of them is only
+    recomputed when the config options it depends on change.
+    """
 
     # define configuration properties that are forwarded to self.config
     xdimension = _configPropertyR("xdimension")
@@ -43,58 +152,292 @@ class Calculate(object):
     tthstepd = _configPropertyR("tthstepd")
     tthorqstep = _configPropertyR("tthorqstep")
     tthorqmax = _configPropertyR("tthorqmax")
+    azimuthstep = _configPropertyR("azimuthstep")
     uncertaintyenable = _configPropertyR("uncertaintyenable")
     sacorrectionenable = _configPropertyR("sacorrectionenable")
     polcorrectionenable = _configPropertyR("polcorrectionenable")
     polcorrectf = _configPropertyR("polcorrectf")
     cropedges = _configPropertyR("cropedges")
     extracrop = _configPropertyR("extracrop")
+    integrationmethod = _configPropertyR("integrationmethod")
+    precision = _configPropertyR("precision")
+    uncertaintymode = _configPropertyR("uncertaintymode")
+    gainstride = _configPropertyR("gainstride")
+    gainreuse = _configPropertyR("gainreuse")
+    detectorgain = _configPropertyR("detectorgain")
+    integrationstatistic = _configPropertyR("integrationstatistic")
+    sigmaclipk = _configPropertyR("sigmaclipk")
+    sigmaclipiterations = _configPropertyR("sigmaclipiterations")
+    percentile = _configPropertyR("percentile")
+    trimfraction = _configPropertyR("trimfraction")
+    nthreads = _configPropertyR("nthreads")
 
     def __init__(self, p):
         # create parameter proxy, so that parameters can be
         # accessed by self.parametername in read-only mode
         self.config = p
+        self.cache = GeometryCache(p)
+        self._lazycache = {}
+        self.blockmatrices = None
         self.prepareCalculation()
         return
 
     def prepareCalculation(self):
-        """Prepare data for calculation."""
-        self.xydimension = self.xdimension * self.ydimension
-        self.xr = (
+        """Prepare data for calculation.
+
+        Geometry matrices are computed on demand, so only the mask
+        related data and the reused gain are reset here.
+        """
+        self.perviousmaskedmatrix = None
+        self.geometrytable = None
+        self.caketable = None
+        self.labeltable = None
+        self.resetGain()
+        return
+
+    def exportGeometry(self):
+        """Get the lazily computed attributes that are up to date with
+        the current config, so that they can be shared with other
+        Calculate instances of the same config (see
+        self.importGeometry).
+
+        :return: dict, name -> 2d array or sparse matrix
+        """
+        rv = {}
+        for name, (state, value) in self._lazycache.items():
+            deps = _lazydeps[name]
+            current = tuple(_normalize(getattr(self.config, d)) for d in deps)
+            if state == current:
+                rv[name] = value
+        return rv
+
+    def importGeometry(self, arrays):
+        """Use the attributes exported by another Calculate instance of
+        the same config instead of computing them.
+
+        :param arrays: dict, name -> 2d array or sparse matrix, result
+            of self.exportGeometry
+        :return: None
+        """
+        for name, value in arrays.items():
+            setattr(self, name, value)
+        return
+
+    def resetGain(self):
+        """Forget the gain reused between images (see
+        self.calculateGain), it should be called when the exposure
+        conditions change."""
+        self.gain = None
+        return
+
+    def runBlocks(self, func, nrows):
+        """Split rows of an image into self.nthreads blocks and process
+        them in the thread pool shared by all instances. func should
+        mostly run NumPy/SciPy operations that release the GIL.
+
+        :param func: callable, func(r0, r1) processes rows r0 to r1
+        :param nrows: int, number of rows
+        :return: list, results of func for each block, in order
+        """
+        nthreads = max(min(self.nthreads, nrows), 1)
+        if nthreads == 1:
+            return [func(0, nrows)]
+        futures = _submitBlocks(func, self._blockBounds(nrows))
+        return [f.result() for f in futures]
+
+    def _blockBounds(self, nrows):
+        """Bounds of row blocks used in self.runBlocks.
+
+        :param nrows: int, number of rows
+        :return: 1d int array, start of each block and end of last block
+        """
+        nthreads = max(min(self.nthreads, nrows), 1)
+        return np.linspace(0, nrows, nthreads + 1).astype(int)
+
+    def genBlockMatrices(self):
+        """Split the sparse pixel-to-bin matrix (self.genBinMatrix) into
+        column blocks, one for each row block of the croped image (see
+        self.runBlocks), so that blocks can be binned in parallel (the
+        sparse matrix products release the GIL).
+
+        :return: dict, {first row of block: scipy.sparse.csc_matrix}
+        """
+        binmatrix = self.genBinMatrix()
+        nrows, ncols = self.getMaskedmatrixPic().shape
+        bounds = self._blockBounds(nrows)
+        bm = self.blockmatrices
+        if (
+            bm is None
+            or bm[0] is not binmatrix
+            or not np.array_equal(bm[1], bounds)
+        ):
+            cscmatrix = ssp.csc_matrix(binmatrix)
+            blocks = {
+                r0: cscmatrix[:, r0 * ncols : r1 * ncols]
+                for r0, r1 in zip(bounds[:-1], bounds[1:])
+            }
+            self.blockmatrices = (binmatrix, bounds, blocks)
+        return self.blockmatrices[2]
+
+    @property
+    def dtype(self):
+        """Data type of matrices and images used in calculation."""
+        return np.dtype(self.precision)
+
+    @property
+    def xydimension(self):
+        return self.xdimension * self.ydimension
+
+    @_lazyProperty(_xoptions)
+    def xr(self):
+        """X coordinates of pixel centers (croped by cropedges)."""
+        xr = (
             np.arange(self.xdimension, dtype=float) - self.xbeamcenter + 0.5
         ) * self.xpixelsize
-        self.yr = (
+        return xr[self.cropedges[0] : -self.cropedges[1]]
+
+    @_lazyProperty(_yoptions)
+    def yr(self):
+        """Y coordinates of pixel centers (croped by cropedges)."""
+        yr = (
             np.arange(self.ydimension, dtype=float) - self.ybeamcenter + 0.5
         ) * self.ypixelsize
+        return yr[self.cropedges[2] : -self.cropedges[3]]
+
+    # The geometry is always calculated in float64 (arccos loses too
+    # much precision at small angles in float32), then the matrices are
+    # stored in self.dtype.
+    @_lazyProperty(_geometryoptions + ["precision"], disk=True)
+    def dmatrix(self):
+        """Distance between source and each pixel."""
+        return self.genDistanceMatrix().astype(self.dtype)
 
-        self.xr = self.xr[self.cropedges[0] : -self.cropedges[1]]
-        self.yr = self.yr[self.cropedges[2] : -self.cropedges[3]]
+    @_lazyProperty(_geometryoptions + ["precision"], disk=True)
+    def tthmatrix(self):
+        """Two theta angle (in radians) of each pixel."""
+        return self.genTTHMatrix().astype(self.dtype)
 
-        self.dmatrix = self.genDistanceMatrix()
-        self.azimuthmatrix = np.arctan2(
-            self.yr.reshape(len(self.yr), 1), self.xr.reshape(1, len(self.xr))
+    @_lazyProperty(_xoptions + _yoptions + ["precision"], disk=True)
+    def azimuthmatrix(self):
+        """Azimuthal angle (in radians) of each pixel."""
+        rv = np.arctan2(
+            self.yr.reshape(len(self.yr), 1),
+            self.xr.reshape(1, len(self.xr)),
         )
-        self.genTTHorQMatrix()
-        self.perviousmaskedmatrix = np.zeros(4)
-        return
+        return rv.astype(self.dtype)
+
+    @_lazyProperty(_geometryoptions + ["precision", "integrationspace"])
+    def radialmatrix(self):
+        """Wavelength independent radial coordinate of each pixel, two
+        theta in 'twotheta' space, 4*pi*sin(theta) in 'qspace'."""
+        if self.integrationspace == "twotheta":
+            rv = self.tthmatrix
+        else:
+            tthmatrix = np.asarray(self.tthmatrix, dtype=float)
+            rv = (4 * np.pi * np.sin(tthmatrix / 2.0)).astype(self.dtype)
+        return rv
+
+    @_lazyProperty(
+        _geometryoptions + ["precision", "integrationspace", "wavelength"]
+    )
+    def tthorqmatrix(self):
+        """Two theta or q value of each pixel."""
+        if self.integrationspace == "twotheta":
+            rv = self.radialmatrix
+        else:
+            rv = (self.radialmatrix / self.wavelength).astype(self.dtype)
+        return rv
+
+    @_lazyProperty(_binoptions)
+    def bin_edges(self):
+        """Bin edges of integrated 1d pattern."""
+        return self.genBinEdges()
+
+    @_lazyProperty(_binoptions)
+    def xgrid(self):
+        """Tth (in degrees) or q grid of integrated 1d pattern."""
+        if self.integrationspace == "twotheta":
+            rv = np.degrees(self.bin_edges[1:] - self.tthstep / 2)
+        else:
+            rv = self.bin_edges[1:] - self.qstep / 2
+        return rv
+
+    @_lazyProperty(["azimuthstepd"])
+    def azimuthgrid(self):
+        """Azimuthal angle (in degrees) grid of 2D caked pattern."""
+        nazimuth = int(np.ceil(2 * np.pi / self.azimuthstep - 1e-8))
+        rv = (np.arange(nazimuth) + 0.5) * self.azimuthstep - np.pi
+        return np.degrees(rv)
+
+    @_lazyProperty(_xoptions + _yoptions + ["precision", "azimuthstepd"])
+    def azimuthinds(self):
+        """Azimuthal bin index of each pixel (croped by cropedges)."""
+        azimuthmatrix = np.asarray(self.azimuthmatrix, dtype=float)
+        rv = np.floor((azimuthmatrix + np.pi) / self.azimuthstep)
+        rv = rv.astype(np.intp)
+        return np.clip(rv, 0, len(self.azimuthgrid) - 1, out=rv)
+
+    @property
+    def radialedges(self):
+        """Bin edges in the unit of self.radialmatrix, only rescaled
+        when the wavelength changes."""
+        if self.integrationspace == "twotheta":
+            rv = self.bin_edges
+        else:
+            rv = self.bin_edges * self.wavelength
+        return rv
+
+    @_lazyProperty(
+        _geometryoptions
+        + ["precision", "sacorrectionenable", "polcorrectionenable"]
+        + ["polcorrectf"],
+        disk=True,
+    )
+    def correctionmatrix(self):
+        """Correction matrix, see self.genCorrectionMatrix."""
+        rv = self._solidAngleCorrection() * self._polarizationCorrection()
+        return rv.astype(self.dtype)
+
+    @_lazyProperty(
+        _geometryoptions + _binoptions + ["precision", "wavelength"], disk=True
+    )
+    def lutinds(self):
+        """Bin index of each pixel (croped by cropedges), pixels out of
+        the integration range are assigned to the overflow bin."""
+        rv = self._genBinInds(self.radialmatrix, self.radialedges)
+        return rv.reshape(self.radialmatrix.shape)
+
+    @_lazyProperty(_geometryoptions + ["integrationspace"])
+    def pixelranges(self):
+        """Range of wavelength independent radial coordinate covered by
+        each pixel, see self.genPixelRanges."""
+        return self.genPixelRanges()
+
+    @_lazyProperty(
+        _geometryoptions + _binoptions + ["precision", "wavelength"], disk=True
+    )
+    def splitmatrix(self):
+        """Fractional weight of each pixel in each bin, see
+        self.genSplitMatrix."""
+        return self.genSplitMatrix()
 
     def genTTHorQMatrix(self):
         """Generate a twotheta matrix or q matrix which stores the tth
         or q value or each pixel."""
-        # set tth or q grid
+        return self.tthorqmatrix
+
+    def genBinEdges(self):
+        """Generate the bin edges of integrated 1d pattern.
+
+        :return: 1d array, bin edges in tth (radians) or q
+        """
         if self.integrationspace == "twotheta":
-            self.bin_edges = np.r_[
+            rv = np.r_[
                 0, np.arange(self.tthstep / 2, self.tthmax, self.tthstep)
             ]
-            self.xgrid = np.degrees(self.bin_edges[1:] - self.tthstep / 2)
-            self.tthorqmatrix = self.genTTHMatrix()
-        elif self.integrationspace == "qspace":
-            self.bin_edges = np.r_[
-                0, np.arange(self.qstep / 2, self.qmax, self.qstep)
-            ]
-            self.xgrid = self.bin_edges[1:] - self.qstep / 2
-            self.tthorqmatrix = self.genQMatrix()
-        return
+        else:
+            rv = np.r_[0, np.arange(self.qstep / 2, self.qmax, self.qstep)]
+        return rv
 
     def genIntegrationInds(self, mask=None):
         """Generate self.bin_number used in integration (number of
@@ -106,11 +449,15 @@ class Calculate(object):
         """
         self.maskedmatrix = np.array(self.tthorqmatrix)
         if mask is None:
-            # mask = np.zeros((self.ydimension, self.xdimension), dtype=bool)
-            mask = np.zeros((len(self.yr), len(self.xr)), dtype=bool)
+            mask = np.zeros((self.ydimension, self.xdimension), dtype=bool)
         ce = self.cropedges
         mask = mask[ce[2] : -ce[3], ce[0] : -ce[1]]
+        self.integrationmask = np.asarray(mask, dtype=bool)
+        self.caketable = None
+        self.labeltable = None
         self.maskedmatrix[mask] = 1000.0
+        # mask changed, force the regeneration of bin table
+        self.perviousmaskedmatrix = None
 
         # extra crop
         self.getMaskedmatrixPic()
@@ -121,55 +468,578 @@ class Calculate(object):
         # self.bin_number[self.bin_number <= 0] = 1
         return  # self.bin_number
 
-    def intensity(self, pic):
+    def intensity(self, pic, correction=None, nframes=1):
         """2D to 1D image integration, intensity of pixels are binned
         and then take average,
 
         :param pic: 2D array, array of raw counts, corrections should be
             already applied
+        :param correction: 2d array, correction matrix (same shape as
+            self.tthorqmatrix) already applied to pic, only used by the
+            'poisson' uncertainty mode, None if pic is not corrected
+        :param nframes: int, number of frames averaged in pic, only used
+            by the 'poisson' uncertainty mode
         :return: 2d array, [tthorq, intensity, unceratinty] or [tthorq,
             intensity]
         """
 
         intensity = self.calculateIntensity(pic)
         if self.uncertaintyenable:
-            std = np.sqrt(self.calculateVariance(pic))
+            variance = self._binVariance(pic, intensity, correction, nframes)
+            std = np.sqrt(variance)
             rv = np.vstack([self.xgrid, intensity, std])
         else:
             rv = np.vstack([self.xgrid, intensity])
         return rv
 
+    def _binVariance(self, pic, intensity, correction=None, nframes=1):
+        """Calculate the variance of integrated intensity according to
+        self.uncertaintymode.
+
+        :param pic: 2D array, same as self.intensity
+        :param intensity: 1d array, self.calculateIntensity(pic)
+        :param correction: 2d array, same as self.intensity
+        :param nframes: int, same as self.intensity
+        :return: 1d array, variance of integrated intensity
+        """
+        # the variance of the average of nframes frames is the variance
+        # of their counts divided by nframes, the local mode estimates it
+        # from the averaged image directly
+        if self.uncertaintymode == "poisson" and correction is not None:
+            rv = self.calculateVariancePoisson(pic, correction) / nframes
+        elif self.uncertaintymode == "poisson":
+            rv = intensity * self.detectorgain / nframes
+        else:
+            # variance of each pixel is pic * gain, so the binned
+            # variance is intensity * gain (same as
+            # self.calculateVariance)
+            gain = self.calculateGain(self.getMaskedmatrixPic(pic)[1])
+            rv = intensity * gain
+        return rv
+
+    def binSums(self, pic, correction=None):
+        """Calculate the per bin sums of intensity and variance of
+        pixels, and the number of pixels in each bin. Unlike the
+        averages given by self.intensity, they can be summed over images
+        (see IntegrationAccumulator).
+
+        :param pic: 2D array, same as self.intensity
+        :param correction: 2d array, same as self.intensity
+        :return: tuple of 1d arrays, (sum of intensity, sum of variance,
+            number of pixels) of each bin
+        """
+        if self.integrationstatistic != "mean":
+            raise ValueError(
+                "per bin sums are only defined for the 'mean' statistic"
+            )
+        intensity = self.calculateIntensity(pic)
+        variance = self._binVariance(pic, intensity, correction)
+        rv = (
+            intensity * self.bin_number,
+            variance * self.bin_number,
+            self.bin_count.copy(),
+        )
+        return rv
+
+    def intensity2D(self, pic):
+        """2D caking, intensity of pixels are binned into a (azimuth,
+        tth or q) grid and then take average. Pixels are not split, the
+        bin table is generated once per geometry and mask.
+
+        :param pic: 2D array, array of raw counts, corrections should be
+            already applied
+        :return: tuple of 2d arrays, (intensity, count), shape is
+            (len of self.azimuthgrid, len of self.xgrid), count is the
+            number of pixels in each bin, bins without pixels have 0
+            intensity
+        """
+        maskedmatrix, pic = self.getMaskedmatrixPic(pic)
+        inds, count = self.genCakeTable()
+        shape = (count.shape[0], count.shape[1] + 1)
+        intensity = np.bincount(
+            inds, weights=pic.ravel(), minlength=shape[0] * shape[1]
+        )
+        intensity = intensity.reshape(shape)[:, :-1]
+        return intensity / np.maximum(count, 1), count
+
+    def genCakeTable(self):
+        """Generate the pixel-to-bin table of 2D caking for pixels in the
+        extra croped region. The radial index of each pixel is taken
+        from self.lutinds (masked pixels are assigned to the overflow
+        bin), and combined with its azimuthal index as azimuthal index
+        * (len of self.xgrid + 1) + radial index.
+
+        :return: tuple, (1d array, combined bin index of each pixel, 2d
+            array, number of pixels in each bin)
+        """
+        s = self._getExtraCropSlice()
+        radial = self.lutinds
+        azimuth = self.azimuthinds
+        ct = self.caketable
+        if (
+            ct is None
+            or ct[0] != tuple(s)
+            or ct[1] is not radial
+            or ct[2] is not azimuth
+        ):
+            nbins = len(self.xgrid)
+            nazimuth = len(self.azimuthgrid)
+            mask = self.integrationmask[s[2] : s[3], s[0] : s[1]].ravel()
+            inds = radial[s[2] : s[3], s[0] : s[1]].ravel()
+            inds = np.where(mask, nbins, inds)
+            inds += azimuth[s[2] : s[3], s[0] : s[1]].ravel() * (nbins + 1)
+            count = np.bincount(inds, minlength=nazimuth * (nbins + 1))
+            count = count.reshape(nazimuth, nbins + 1)[:, :-1]
+            self.caketable = (tuple(s), radial, azimuth, inds, count)
+        return self.caketable[3], self.caketable[4]
+
+    def intensityLabels(self, pic, labels):
+        """Integrate several regions of an image to 1D patterns in one
+        pass, the intensity of pixels are binned into a (region, tth or
+        q) grid and then take average. Pixels are not split.
+
+        :param pic: 2D array, array of raw counts, corrections should be
+            already applied
+        :param labels: 2d int array (same shape as image), region label
+            of each pixel, pixels with negative labels are not
+            integrated. Or a list of 2d bool arrays (same shape as
+            image), True for pixels in each region, regions could
+            overlap. The table is cached for the same labels object, so
+            labels should not be modified in place
+        :return: tuple of 2d arrays, (intensity, count), shape is
+            (number of regions, len of self.xgrid), count is the number
+            of pixels in each bin, bins without pixels have 0 intensity
+        """
+        maskedmatrix, pic = self.getMaskedmatrixPic(pic)
+        table, count = self.genLabelTable(labels)
+        shape = (count.shape[0], count.shape[1] + 1)
+        if ssp.issparse(table):
+            intensity = table.dot(pic.ravel())
+        else:
+            n = shape[0] * shape[1]
+            intensity = np.bincount(table, pic.ravel(), minlength=n + 1)[:n]
+        intensity = intensity.reshape(shape)[:, :-1]
+        return intensity / np.maximum(count, 1), count
+
+    def genLabelTable(self, labels):
+        """Generate the pixel-to-bin table of labeled multi-region
+        integration for pixels in the extra croped region. The radial
+        index of each pixel is taken from self.lutinds (masked pixels
+        are assigned to the overflow bin) and combined with its region
+        index as region index * (len of self.xgrid + 1) + radial index.
+
+        :param labels: 2d int array or list of 2d bool arrays, see
+            self.intensityLabels
+        :return: tuple, (table, 2d array, number of pixels in each bin),
+            table is a 1d array (combined index of each pixel, pixels
+            not in any region are assigned to the last index) for label
+            image, or a scipy.sparse.csr_matrix (combined index, pixel)
+            for list of regions
+        """
+        s = self._getExtraCropSlice()
+        radial = self.lutinds
+        lt = self.labeltable
+        if (
+            lt is None
+            or lt[0] is not labels
+            or lt[1] != tuple(s)
+            or lt[2] is not radial
+        ):
+            nbins = len(self.xgrid)
+            mask = self.integrationmask[s[2] : s[3], s[0] : s[1]].ravel()
+            rad = radial[s[2] : s[3], s[0] : s[1]].ravel()
+            rad = np.where(mask, nbins, rad)
+            # crop of full size image, same as self.getMaskedmatrixPic
+            ps = [
+                max(s1, s2) for s1, s2 in zip(self.cropedges, self.extracrop)
+            ]
+            crop = (slice(ps[2], -ps[3]), slice(ps[0], -ps[1]))
+            if isinstance(labels, np.ndarray):
+                nlabels = max(int(labels.max()) + 1, 0)
+                label = labels[crop].ravel().astype(np.intp)
+                table = label * (nbins + 1) + rad
+                table[label < 0] = nlabels * (nbins + 1)
+                n = nlabels * (nbins + 1)
+                count = np.bincount(table, minlength=n + 1)[:n]
+            else:
+                nlabels = len(labels)
+                rows = []
+                cols = []
+                for i, region in enumerate(labels):
+                    col = np.flatnonzero(region[crop])
+                    rows.append(rad[col] + i * (nbins + 1))
+                    cols.append(col)
+                rows = np.concatenate(rows) if rows else np.zeros(0, int)
+                cols = np.concatenate(cols) if cols else np.zeros(0, int)
+                table = ssp.csr_matrix(
+                    (np.ones(len(rows)), (rows, cols)),
+                    shape=(nlabels * (nbins + 1), rad.size),
+                )
+                count = np.bincount(rows, minlength=nlabels * (nbins + 1))
+            count = count.reshape(nlabels, nbins + 1)[:, :-1]
+            self.labeltable = (labels, tuple(s), radial, table, count)
+        return self.labeltable[3], self.labeltable[4]
+
+    def intensityStatistics(self, pic):
+        """Calculate the sum, sum of squares, min, max and number of
+        pixels in each bin. Pixels are gathered in the bin order
+        precomputed by self.genStatOrder in one pass, then each
+        statistic is reduced over the contiguous segment of each bin.
+        Pixels are not split.
+
+        :param pic: 2D array, array of raw counts, corrections should be
+            already applied
+        :return: dict of 1d arrays (len of self.xgrid), 'sum', 'sumsq',
+            'min', 'max', 'count' of pixels in each bin, and derived
+            'mean', 'variance' (of pixels in each bin) and 'stderr'
+            (standard error of the mean). Empty bins have 0 in all
+            statistics
+        """
+        maskedmatrix, pic = self.getMaskedmatrixPic(pic)
+        nbins = len(self.xgrid)
+        order, bounds = self.genStatOrder()
+        values = np.asarray(pic, dtype=float).ravel()[order]
+        count = np.diff(bounds)
+        nonempty = np.flatnonzero(count)
+        starts = bounds[nonempty]
+        rv = {}
+        # the gather dominates, separate 1d reductions are faster than
+        # one reduction over the stacked values (2, npix)
+        for name, ufunc, v in [
+            ("sum", np.add, values),
+            ("sumsq", np.add, values**2),
+            ("min", np.minimum, values),
+            ("max", np.maximum, values),
+        ]:
+            rv[name] = np.zeros(nbins)
+            if len(values) > 0:
+                rv[name][nonempty] = ufunc.reduceat(v, starts)
+        rv["count"] = count.astype(float)
+        n = np.maximum(count, 1)
+        rv["mean"] = rv["sum"] / n
+        rv["variance"] = np.maximum(rv["sumsq"] / n - rv["mean"] ** 2, 0)
+        rv["stderr"] = np.sqrt(rv["variance"] / n)
+        return rv
+
+    def intensityStack(self, pics, correction=None, chunksize=16):
+        """Integrate a stack of 2D images sharing the same geometry and
+        mask. Images are integrated in batches using one sparse matrix
+        product per batch.
+
+        :param pics: 3d array (N, ydimension, xdimension), stack of raw
+            counts, could be a np.memmap. Corrections should be already
+            applied unless correction is specified
+        :param correction: 2d array, correction matrix (same shape as
+            self.tthorqmatrix) applied to each image in the batch, if
+            None, no correction is applied
+        :param chunksize: int, number of images integrated in one batch,
+            limit the memory used by large stacks
+        :return: 3d array, shape is (N, 2, len of intensity) or (N, 3,
+            len of intensity), [tthorq, intensity, (uncertainty)] of
+            each image
+        """
+        nframes = len(pics)
+        nrows = 3 if self.uncertaintyenable else 2
+        rv = np.empty((nframes, nrows, len(self.xgrid)))
+        rv[:, 0] = self.xgrid
+        binmatrix = self.genBinMatrix()
+        if correction is not None:
+            s = self._getExtraCropSlice()
+            correction = correction[s[2] : s[3], s[0] : s[1]]
+        poisson = self.uncertaintymode == "poisson"
+        poisson = poisson and self.uncertaintyenable
+        for i in range(0, nframes, chunksize):
+            chunk = self.getMaskedmatrixPic(pics[i : i + chunksize])[1]
+            chunk = np.array(chunk, dtype=self.dtype)
+            if correction is not None:
+                chunk *= correction
+            n = len(chunk)
+            if self.integrationstatistic != "mean":
+                # robust statistics are calculated image by image
+                intensity = np.empty((n, len(self.xgrid)))
+                if poisson and correction is not None:
+                    variance = np.empty((n, len(self.xgrid)))
+                for j, pic in enumerate(chunk):
+                    intensity[j], inds, count = self._statIntensity(pic)
+                    if poisson and correction is not None:
+                        variance[j] = self._statVariance(
+                            pic * correction, inds, count
+                        )
+                if poisson and correction is not None:
+                    variance *= self.detectorgain
+            else:
+                intensity = binmatrix.dot(chunk.reshape(n, -1).T).T
+                intensity /= self.bin_number
+                if poisson and correction is not None:
+                    # variance of each pixel is pic * correction * gain
+                    variance = chunk * correction
+                    variance = binmatrix.dot(variance.reshape(n, -1).T).T
+                    variance *= self.detectorgain / self.bin_number
+            rv[i : i + n, 1] = intensity
+            if not self.uncertaintyenable:
+                continue
+            # with correction, the poisson variance (pic * correction *
+            # gain) is already binned with the intensity
+            if poisson and correction is None:
+                variance = intensity * self.detectorgain
+            elif not poisson:
+                # variance of each pixel is pic * gain
+                gain = self.calculateGainStack(chunk)
+                variance = intensity * gain.reshape(n, 1)
+            rv[i : i + n, 2] = np.sqrt(variance)
+        return rv
+
     def getMaskedmatrixPic(self, pic=None):
         """Return the maskedmatrix and pic using self.extracrop and
         self.cropedges.
 
         :param pic: 2d array, pic array, if None, then only return
-            maskedmatrix
+            maskedmatrix. 3d array (stack of pic) is also accepted, the
+            last two axes are croped
         :return: croped maskedmatrix and pic
         """
         ec = self.extracrop
         ce = self.cropedges
-        s = [ecx - cex if ecx > cex else 0 for ecx, cex in zip(ec, ce)]
-        s[3] = -s[3] if s[3] != 0 else None
-        s[1] = -s[1] if s[1] != 0 else None
+        s = self._getExtraCropSlice()
         rv = self.maskedmatrix[s[2] : s[3], s[0] : s[1]]
 
-        temps = np.array(s)
-        if any(self.perviousmaskedmatrix != temps):
+        temps = tuple(s)
+        if self.perviousmaskedmatrix != temps:
             self.perviousmaskedmatrix = temps
-            self.bin_number = np.array(
-                np.histogram(rv, self.bin_edges)[0], dtype=float
-            )
-            self.bin_number[self.bin_number <= 0] = 1
+            self.genBinTable(rv)
 
         if pic is not None:
             ps = [max(s1, s2) for s1, s2 in zip(ce, ec)]
             rv = (
                 self.maskedmatrix[s[2] : s[3], s[0] : s[1]],
-                pic[ps[2] : -ps[3], ps[0] : -ps[1]],
+                pic[..., ps[2] : -ps[3], ps[0] : -ps[1]],
             )
         return rv
 
+    def _getExtraCropSlice(self):
+        """Get the slice of self.extracrop relative to the matrices
+        already croped by self.cropedges (such as self.tthorqmatrix).
+
+        :return: list, [left, right, top, bottom] bounds of slice
+        """
+        ec = self.extracrop
+        ce = self.cropedges
+        s = [ecx - cex if ecx > cex else 0 for ecx, cex in zip(ec, ce)]
+        s[3] = -s[3] if s[3] != 0 else None
+        s[1] = -s[1] if s[1] != 0 else None
+        return s
+
+    def genBinTable(self, maskedmatrix):
+        """Generate the pixel-to-bin table and the number of pixels in
+        each bin (self.bin_number). The table only depends on the
+        geometry, mask and crop, so it is generated once and reused for
+        every image.
+
+        'lut' method: self.bin_inds stores the bin index of each pixel,
+        pixels out of the integration range (including masked pixels)
+        are assigned to an overflow bin (index len(self.xgrid)), which
+        is dropped after binning.
+        'splitpixel' method: self.bin_matrix stores the fractional
+        weight of each pixel in each bin, self.bin_number is the sum of
+        weights in each bin.
+
+        :param maskedmatrix: 2d array, croped tth or q matrix, masked
+            pixels are set to 1000
+        :return: None
+        """
+        nbins = len(self.bin_edges) - 1
+        self.bin_matrix = None
+        self.bin_inds = None
+        self.statbaseinds = None
+        self.statorder = None
+        if self.integrationmethod == "histogram":
+            self.bin_number = np.array(
+                np.histogram(maskedmatrix, self.bin_edges)[0], dtype=float
+            )
+        else:
+            s = self._getExtraCropSlice()
+            mask = self.integrationmask[s[2] : s[3], s[0] : s[1]].ravel()
+            table = self.genGeometryTable()
+            if self.integrationmethod == "splitpixel":
+                # zero the weights of masked pixels, keep the structure
+                valid = np.repeat(np.logical_not(mask), np.diff(table.indptr))
+                self.bin_matrix = ssp.csc_matrix(
+                    (table.data * valid, table.indices, table.indptr),
+                    shape=table.shape,
+                )
+                self.bin_number = np.asarray(
+                    self.bin_matrix.sum(axis=1), dtype=float
+                ).ravel()
+            else:
+                self.bin_inds = table.copy()
+                self.bin_inds[mask] = nbins
+                self.bin_number = np.bincount(
+                    self.bin_inds, minlength=nbins + 1
+                )[:nbins].astype(float)
+        # number of pixels in each bin, self.bin_number is clipped to 1
+        # to avoid division by zero
+        self.bin_count = self.bin_number.copy()
+        self.bin_number[self.bin_number <= 0] = 1
+        return
+
+    def genGeometryTable(self):
+        """Generate the mask independent part of the pixel-to-bin table
+        for pixels in the extra croped region. It is cached until the
+        geometry or the crop changes.
+
+        :return: 1d array, bin index of each pixel for the 'lut'
+            method, or scipy.sparse.csc_matrix, fractional weight of
+            each pixel in each bin for the 'splitpixel' method
+        """
+        s = self._getExtraCropSlice()
+        if self.integrationmethod == "splitpixel":
+            source = self.splitmatrix
+        else:
+            source = self.lutinds
+        # the source table is kept and checked by identity, it is
+        # regenerated when the geometry changes
+        key = (self.integrationmethod, tuple(s))
+        gt = self.geometrytable
+        if gt is None or gt[0] != key or gt[1] is not source:
+            if self.integrationmethod == "splitpixel":
+                table = source
+                if s != [0, None, 0, None]:
+                    cols = np.arange(table.shape[1]).reshape(
+                        self.radialmatrix.shape
+                    )
+                    cols = cols[s[2] : s[3], s[0] : s[1]].ravel()
+                    table = table[:, cols]
+            else:
+                table = source[s[2] : s[3], s[0] : s[1]].ravel()
+            self.geometrytable = (key, source, table)
+        return self.geometrytable[2]
+
+    def genPixelRanges(self):
+        """Generate the range of wavelength independent radial
+        coordinate (see self.radialmatrix) covered by each pixel. The
+        range is taken from the values at the four corners of pixel.
+
+        :return: 2d array, shape is (2, number of pixels), the low and
+            high end of range of each pixel (croped by self.cropedges)
+        """
+        ce = self.cropedges
+        xc = (
+            np.arange(self.xdimension + 1, dtype=float) - self.xbeamcenter
+        ) * self.xpixelsize
+        yc = (
+            np.arange(self.ydimension + 1, dtype=float) - self.ybeamcenter
+        ) * self.ypixelsize
+        xc = xc[ce[0] : self.xdimension - ce[1] + 1]
+        yc = yc[ce[2] : self.ydimension - ce[3] + 1]
+        corners = self.genTTHMatrix(xc, yc)
+        if self.integrationspace == "qspace":
+            corners = 4 * np.pi * np.sin(corners / 2.0)
+        c = [corners[:-1, :-1], corners[:-1, 1:], corners[1:, :-1]]
+        c.append(corners[1:, 1:])
+        low = np.minimum(np.minimum(c[0], c[1]), np.minimum(c[2], c[3]))
+        high = np.maximum(np.maximum(c[0], c[1]), np.maximum(c[2], c[3]))
+        return np.vstack([low.ravel(), high.ravel()])
+
+    def genSplitMatrix(self):
+        """Generate the sparse (nbins, npixels) matrix used in pixel
+        splitting. Each pixel is split into bins in proportion to the
+        overlap of its range (self.pixelranges) with each bin.
+
+        :return: scipy.sparse.csc_matrix, fractional weight of each
+            pixel (in the region croped by self.cropedges) in each bin
+        """
+        low, high = self.pixelranges
+        width = high - low
+
+        edges = self.radialedges
+        nbins = len(edges) - 1
+        # bins covered by each pixel, clipped to the integration range
+        firstbin = np.searchsorted(edges, low, side="right") - 1
+        lastbin = np.searchsorted(edges, high, side="right") - 1
+        firstbin = np.maximum(firstbin, 0)
+        lastbin = np.minimum(lastbin, nbins - 1)
+        nspan = np.maximum(lastbin - firstbin + 1, 0)
+
+        # entries are grouped by pixel, so build the csc matrix directly
+        indptr = np.concatenate([[0], np.cumsum(nspan)])
+        pixel = np.repeat(np.arange(low.size), nspan)
+        b = np.arange(indptr[-1]) - indptr[pixel] + firstbin[pixel]
+        overlap = np.minimum(high[pixel], edges[b + 1])
+        overlap -= np.maximum(low[pixel], edges[b])
+        w = width[pixel]
+        # pixels with zero width fall in one bin
+        weight = np.ones(len(b))
+        np.divide(overlap, w, out=weight, where=w > 0)
+        rv = ssp.csc_matrix((weight, b, indptr), shape=(nbins, low.size))
+        return rv
+
+    def _genBinInds(self, maskedmatrix, edges=None):
+        """Find the bin index of each pixel.
+
+        :param maskedmatrix: 2d array, croped tth or q matrix, masked
+            pixels are set to 1000
+        :param edges: 1d array, bin edges in the same unit as
+            maskedmatrix, if None, use self.bin_edges
+        :return: 1d array, bin index of each pixel (raveled), pixels out
+            of range are assigned to the overflow bin len(self.xgrid)
+        """
+        edges = self.bin_edges if edges is None else edges
+        nbins = len(edges) - 1
+        mm = maskedmatrix.ravel()
+        inds = np.searchsorted(edges, mm, side="right") - 1
+        # same as np.histogram, the last bin includes its right edge
+        inds[mm == edges[-1]] = nbins - 1
+        inds[np.logical_or(inds < 0, inds >= nbins)] = nbins
+        return inds.astype(np.intp, copy=False)
+
+    def genBinMatrix(self):
+        """Generate the sparse (nbins, npixels) matrix equivalent to the
+        pixel-to-bin lookup table. It is used to integrate a stack of
+        images in one sparse matrix product.
+
+        :return: scipy.sparse matrix, self.bin_matrix
+        """
+        maskedmatrix = self.getMaskedmatrixPic()
+        if self.bin_matrix is None:
+            inds = self.bin_inds
+            if inds is None:
+                inds = self._genBinInds(maskedmatrix)
+            nbins = len(self.xgrid)
+            cols = np.nonzero(inds < nbins)[0]
+            self.bin_matrix = ssp.csr_matrix(
+                (np.ones(len(cols)), (inds[cols], cols)),
+                shape=(nbins, inds.size),
+            )
+        return self.bin_matrix
+
+    def _binSum(self, maskedmatrix, weights):
+        """Sum the weights of pixels in each bin.
+
+        :param maskedmatrix: 2d array, croped tth or q matrix, only used
+            by the 'histogram' integration method
+        :param weights: 2d array, croped weights of each pixel
+        :return: 1d array, sum of weights in each bin
+        """
+        if self.integrationmethod == "histogram":
+            # accumulate in float64, np.histogram sums in weights.dtype
+            weights = np.asarray(weights, dtype=float)
+            rv = np.histogram(maskedmatrix, self.bin_edges, weights=weights)[0]
+        elif self.nthreads > 1:
+            blocks = self.genBlockMatrices()
+
+            def binBlock(r0, r1):
+                return blocks[r0].dot(np.ravel(weights[r0:r1]))
+
+            rv = np.sum(self.runBlocks(binBlock, len(weights)), axis=0)
+        elif self.integrationmethod == "splitpixel":
+            rv = self.bin_matrix.dot(weights.ravel())
+        else:
+            nbins = len(self.xgrid)
+            rv = np.bincount(
+                self.bin_inds, weights=weights.ravel(), minlength=nbins + 1
+            )[:nbins]
+        return rv
+
     def calculateIntensity(self, pic):
         """Calculate the 1D intensity.
 
@@ -180,9 +1050,183 @@ class Calculate(object):
 
         maskedmatrix, pic = self.getMaskedmatrixPic(pic)
 
-        intensity = np.histogram(maskedmatrix, self.bin_edges, weights=pic)[0]
+        if self.integrationstatistic != "mean":
+            intensity, self.statinds, self.statcount = self._statIntensity(pic)
+            return intensity
+        intensity = self._binSum(maskedmatrix, pic)
         return intensity / self.bin_number
 
+    def _statIntensity(self, pic):
+        """Calculate the 1D intensity using the robust statistic in
+        self.integrationstatistic. Pixels are not split.
+
+        :param pic: 2d array, croped image, corrections should be
+            already applied
+        :return: tuple, (1d array, 1D integrated intensity, 1d array,
+            bin index of each pixel, pixels rejected by the statistic
+            are assigned to the overflow bin, 1d array, number of pixels
+            used in each bin)
+        """
+        if self.integrationstatistic == "sigmaclip":
+            rv = self._sigmaClip(pic)
+        else:
+            rv = self._orderStatistic(pic)
+        return rv
+
+    def _sigmaClip(self, pic):
+        """Sigma clipped mean of pixels in each bin. Pixels deviating
+        from the mean of their bin by more than self.sigmaclipk * the
+        standard deviation of the bin are rejected, and the mean is
+        recalculated, for at most self.sigmaclipiterations iterations.
+        The mean is calculated from per bin sums, the variance from the
+        deviations to the mean (two passes), so that it does not cancel
+        out in bins of low noise. Bins whose variance is at the rounding
+        level of their mean reject nothing, and the pixels of a bin are
+        never all rejected.
+
+        :param pic: 2d array, croped image, corrections should be
+            already applied
+        :return: tuple, see self._statIntensity
+        """
+        nbins = len(self.xgrid)
+        pic = np.asarray(pic, dtype=float).ravel()
+        inds = self.genStatInds()
+        count = np.bincount(inds, minlength=nbins + 1).astype(float)
+        total = np.bincount(inds, pic, minlength=nbins + 1)
+        k2 = self.sigmaclipk**2
+        eps = np.finfo(float).eps
+        copied = False
+        for i in range(self.sigmaclipiterations):
+            n = np.maximum(count, 1)
+            mean = total / n
+            dev = pic - mean[inds]
+            dev *= dev
+            variance = np.bincount(inds, dev, minlength=nbins + 1) / n
+            # squared deviation limit of each bin, k**2 * variance
+            limit = variance * k2
+            limit[variance <= eps * mean**2] = np.inf
+            # pixels in the overflow bin stay there
+            limit[nbins] = np.inf
+            reject = np.flatnonzero(dev > limit[inds])
+            if len(reject) == 0:
+                break
+            rinds = inds[reject]
+            rcount = np.bincount(rinds, minlength=nbins + 1)
+            # keep the bins with all pixels rejected (e.g. k < 1)
+            keep = rcount[rinds] < count[rinds]
+            reject = reject[keep]
+            rinds = rinds[keep]
+            if len(reject) == 0:
+                break
+            # only a few pixels are rejected, remove them from the sums
+            # instead of binning all pixels again
+            count -= np.bincount(rinds, minlength=nbins + 1)
+            total -= np.bincount(rinds, pic[reject], minlength=nbins + 1)
+            if not copied:
+                inds = inds.copy()
+                copied = True
+            inds[reject] = nbins
+        count = count[:nbins]
+        intensity = total[:nbins] / np.maximum(count, 1)
+        return intensity, inds, count
+
+    def _orderStatistic(self, pic):
+        """Median, percentile (self.percentile) or trimmed mean (trim
+        self.trimfraction of pixels from each end) of pixels in each
+        bin. Pixels are gathered in the bin order precomputed by
+        self.genStatOrder, then each bin is partially sorted.
+
+        :param pic: 2d array, croped image, corrections should be
+            already applied
+        :return: tuple, see self._statIntensity, all pixels in each bin
+            are counted as used
+        """
+        statistic = self.integrationstatistic
+        if statistic == "trimmedmean" and not 0 <= self.trimfraction < 0.5:
+            raise ValueError(
+                "trimfraction should be in [0, 0.5), got %s"
+                % self.trimfraction
+            )
+        if statistic == "percentile" and not 0 <= self.percentile <= 100:
+            raise ValueError(
+                "percentile should be in [0, 100], got %s" % self.percentile
+            )
+        nbins = len(self.xgrid)
+        inds = self.genStatInds()
+        order, bounds = self.genStatOrder()
+        values = np.asarray(pic, dtype=float).ravel()[order]
+        count = np.diff(bounds)
+        intensity = np.zeros(nbins)
+        q = 0.5 if statistic == "median" else self.percentile / 100.0
+        for b in np.flatnonzero(count):
+            # values is a copy, so bins can be partitioned in place
+            seg = values[bounds[b] : bounds[b + 1]]
+            n = len(seg)
+            if statistic == "trimmedmean":
+                lo = int(n * self.trimfraction)
+                hi = n - lo
+                seg.partition([lo, hi - 1])
+                intensity[b] = seg[lo:hi].mean()
+            else:
+                # linear interpolation, same as np.percentile
+                pos = q * (n - 1)
+                lo = int(pos)
+                hi = min(lo + 1, n - 1)
+                seg.partition([lo, hi])
+                intensity[b] = seg[lo] + (seg[hi] - seg[lo]) * (pos - lo)
+        return intensity, inds, count.astype(float)
+
+    def genStatOrder(self):
+        """Generate the order of pixels sorted by bin, used by order
+        statistics. It only depends on the geometry and mask, so it is
+        generated once and reused for every image.
+
+        :return: tuple, (1d array, index of pixels (not masked) sorted by
+            bin, 1d array, start of each bin in the sorted pixels, and
+            the end of the last bin)
+        """
+        if self.statorder is None:
+            nbins = len(self.xgrid)
+            inds = self.genStatInds()
+            order = np.argsort(inds, kind="stable")
+            count = np.bincount(inds, minlength=nbins + 1)[:nbins]
+            bounds = np.concatenate([[0], np.cumsum(count)])
+            self.statorder = (order[: bounds[-1]], bounds)
+        return self.statorder
+
+    def _statVariance(self, pic, inds, count):
+        """Calculate the variance of integrated intensity from the
+        variance of each pixel, only using pixels accepted by the
+        robust statistic.
+
+        :param pic: 2d array, croped variance of each pixel
+        :param inds: 1d array, bin index of each pixel, see
+            self._statIntensity
+        :param count: 1d array, number of pixels used in each bin
+        :return: 1d array, variance of integrated intensity
+        """
+        nbins = len(count)
+        variance = np.bincount(inds, pic.ravel(), minlength=nbins + 1)
+        return variance[:nbins] / np.maximum(count, 1)
+
+    def genStatInds(self):
+        """Generate the bin index of each pixel used by robust
+        statistics, pixels are not split (same as the 'lut' method) and
+        masked pixels are assigned to the overflow bin.
+
+        :return: 1d array, bin index of each pixel in the extra croped
+            region
+        """
+        if self.bin_inds is not None:
+            return self.bin_inds
+        if self.statbaseinds is None:
+            nbins = len(self.xgrid)
+            s = self._getExtraCropSlice()
+            mask = self.integrationmask[s[2] : s[3], s[0] : s[1]].ravel()
+            inds = self.lutinds[s[2] : s[3], s[0] : s[1]].ravel()
+            self.statbaseinds = np.where(mask, nbins, inds)
+        return self.statbaseinds
+
     def calculateVariance(self, pic):
         """Calculate the 1D intensity.
 
@@ -193,9 +1237,33 @@ class Calculate(object):
         maskedmatrix = self.getMaskedmatrixPic()
 
         picvar = self.calculateVarianceLocal(pic)
-        variance = np.histogram(maskedmatrix, self.bin_edges, weights=picvar)[
-            0
-        ]
+        variance = self._binSum(maskedmatrix, picvar)
+        return variance / self.bin_number
+
+    def calculateVariancePoisson(self, pic, correction=None):
+        """Calculate the variance of integrated intensity for photon
+        counting detectors. The variance of raw counts is raw counts *
+        self.detectorgain, so the variance of corrected counts is
+        corrected counts * correction * self.detectorgain, no spatial
+        filtering is needed.
+
+        :param pic: 2D array, array of raw counts, corrections should be
+            already applied
+        :param correction: 2d array, correction matrix (same shape as
+            self.tthorqmatrix) already applied to pic, None if pic is
+            not corrected
+        :return: 1d array, variance of integrated intensity
+        """
+        maskedmatrix, pic = self.getMaskedmatrixPic(pic)
+
+        if correction is not None:
+            s = self._getExtraCropSlice()
+            pic = pic * correction[s[2] : s[3], s[0] : s[1]]
+        if self.integrationstatistic != "mean":
+            # use pixels accepted in the last self.calculateIntensity
+            variance = self._statVariance(pic, self.statinds, self.statcount)
+            return variance * self.detectorgain
+        variance = self._binSum(maskedmatrix, pic) * self.detectorgain
         return variance / self.bin_number
 
     def calculateVarianceLocal(self, pic):
@@ -208,22 +1276,123 @@ class Calculate(object):
         """
         maskedmatrix, pic = self.getMaskedmatrixPic(pic)
 
-        picavg = snf.uniform_filter(pic, 5, mode="wrap")
-        pics2 = (pic - picavg) ** 2
-        pvar = snf.uniform_filter(pics2, 5, mode="wrap")
-
-        gain = pvar / pic
-        inds = np.nonzero(np.logical_and(np.isnan(gain), np.isinf(gain)))
-        gain[inds] = 0
-        gainmedian = np.median(gain, overwrite_input=True)
-        var = pic * gainmedian
+        var = pic * self.calculateGain(pic)
         return var
 
-    def genDistanceMatrix(self):
+    def calculateGain(self, pic):
+        """Calculate the gain (variance / counts) of an image. If
+        self.gainreuse is True, the gain of the first image is reused
+        until self.resetGain is called.
+
+        :param pic: 2d array, croped image, corrections should be
+            already applied
+        :return: float, gain of the image
+        """
+        if self.gainreuse and self.gain is not None:
+            return self.gain
+        rv = self._genGain(pic[np.newaxis])[0]
+        if self.gainreuse:
+            self.gain = rv
+        return rv
+
+    def calculateGainStack(self, pics):
+        """Calculate the gain (variance / counts) of each image in a
+        stack, see self.calculateGain.
+
+        :param pics: 3d array, stack of croped images, corrections
+            should be already applied
+        :return: 1d array, gain of each image
+        """
+        if self.gainreuse:
+            rv = np.full(len(pics), self.calculateGain(pics[0]))
+        else:
+            rv = self._genGain(pics)
+        return rv
+
+    def _genGain(self, pics):
+        """Estimate the gain of each image in a stack according to
+        self.uncertaintymode.
+
+        'local' (reference): the variance of each pixel is the 5x5 local
+        mean of squared deviations from the 5x5 local mean (wrap mode),
+        the gain is the median of variance / counts over all pixels.
+        'fast': the variance is only calculated at a strided subsample
+        of pixels (self.gainstride) in one pass over their 5x5 windows,
+        as the mean of squares minus the squared mean, and the gain is
+        the median of variance / counts over the subsample.
+
+        :param pics: 3d array, stack of croped images
+        :return: 1d array, gain of each image
+        """
+        if self.uncertaintymode == "fast":
+            s = self.gainstride
+            ny, nx = pics.shape[1:]
+            # number of sampled windows along y and x
+            my = len(range(0, ny - 4, s))
+            mx = len(range(0, nx - 4, s))
+            gainmedian = np.empty(len(pics))
+            for i, pic in enumerate(pics):
+                # sums of counts and squared counts over 5x5 windows at
+                # sampled pixels, accumulated row by row then column by
+                # column, so only the sampled windows are calculated
+                rowsums = np.zeros((2, my, nx))
+                for k in range(5):
+                    rows = np.asarray(pic[k : k + (my - 1) * s + 1 : s], float)
+                    rowsums[0] += rows
+                    rowsums[1] += rows**2
+                sums = np.zeros((2, my, mx))
+                for k in range(5):
+                    sums += rowsums[:, :, k : k + (mx - 1) * s + 1 : s]
+                mean = sums[0] / 25
+                var = sums[1] / 25 - mean**2
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    gain = var / pic[2 : 2 + my * s : s, 2 : 2 + mx * s : s]
+                gainmedian[i] = np.median(gain[np.isfinite(gain)])
+        elif self.nthreads > 1:
+            gainmedian = np.empty(len(pics))
+            for i, pic in enumerate(pics):
+                gain = np.empty(pic.shape, dtype=pic.dtype)
+
+                def gainBlock(r0, r1):
+                    # rows of block with halo of 4 rows (2 for each
+                    # filter), wrapped around as in the full image
+                    rows = np.arange(r0 - 4, r1 + 4) % len(pic)
+                    sub = pic[rows]
+                    picavg = snf.uniform_filter(sub, 5, mode="wrap")
+                    pics2 = (sub - picavg) ** 2
+                    pvar = snf.uniform_filter(pics2, 5, mode="wrap")
+                    gain[r0:r1] = pvar[4:-4] / sub[4:-4]
+                    return
+
+                self.runBlocks(gainBlock, len(pic))
+                inds = np.nonzero(
+                    np.logical_and(np.isnan(gain), np.isinf(gain))
+                )
+                gain[inds] = 0
+                gainmedian[i] = np.median(gain)
+        else:
+            picavg = snf.uniform_filter(pics, (1, 5, 5), mode="wrap")
+            pics2 = (pics - picavg) ** 2
+            pvar = snf.uniform_filter(pics2, (1, 5, 5), mode="wrap")
+
+            gain = pvar / pics
+            inds = np.nonzero(np.logical_and(np.isnan(gain), np.isinf(gain)))
+            gain[inds] = 0
+            gainmedian = np.median(gain.reshape(len(pics), -1), axis=1)
+        return gainmedian
+
+    def genDistanceMatrix(self, xr=None, yr=None):
         """Calculate the distance matrix.
 
+        :param xr: 1d array, x coordinates of pixels, if None, use
+            self.xr (pixel centers)
+        :param yr: 1d array, y coordinates of pixels, if None, use
+            self.yr
         :return: 2d array, distance between source and each pixel
+            (float64)
         """
+        xr = self.xr if xr is None else xr
+        yr = self.yr if yr is None else yr
         sinr = np.sin(-self.rotation)
         cosr = np.cos(-self.rotation)
         sint = np.sin(self.tilt)
@@ -232,20 +1401,29 @@ class Calculate(object):
         sourceyr = self.distance * sint * sinr
         sourcezr = self.distance * cost
 
-        # dmatrix = np.zeros((self.ydimension, self.xdimension), dtype=float)
-        dmatrix = np.zeros((len(self.yr), len(self.xr)), dtype=float)
-        dmatrix += ((self.xr - sourcexr) ** 2).reshape(1, len(self.xr))
-        dmatrix += ((self.yr - sourceyr) ** 2).reshape(len(self.yr), 1)
+        dmatrix = np.zeros((len(yr), len(xr)), dtype=float)
+        dmatrix += ((xr - sourcexr) ** 2).reshape(1, len(xr))
+        dmatrix += ((yr - sourceyr) ** 2).reshape(len(yr), 1)
         dmatrix += sourcezr**2
-        self.dmatrix = np.sqrt(dmatrix)
-        return self.dmatrix
+        dmatrix = np.sqrt(dmatrix)
+        return dmatrix
 
-    def genTTHMatrix(self):
+    def genTTHMatrix(self, xr=None, yr=None):
         """Calculate the diffraction angle matrix.
 
+        :param xr: 1d array, x coordinates of pixels, if None, use
+            self.xr (pixel centers)
+        :param yr: 1d array, y coordinates of pixels, if None, use
+            self.yr
         :return: 2d array, two theta angle (in radians) of each pixel's
-            center
+            center (or each point in xr, yr) (float64)
         """
+        if xr is None and self.dtype == np.float64:
+            xr, yr, dmatrix = self.xr, self.yr, self.dmatrix
+        else:
+            xr = self.xr if xr is None else xr
+            yr = self.yr if yr is None else yr
+            dmatrix = self.genDistanceMatrix(xr, yr)
 
         sinr = np.sin(-self.rotation)
         cosr = np.cos(-self.rotation)
@@ -255,49 +1433,24 @@ class Calculate(object):
         sourceyr = self.distance * sint * sinr
         sourcezr = self.distance * cost
 
-        # tthmatrix1 = np.zeros(
-        #     (self.ydimension, self.xdimension),
-        #     dtype=float,
-        # )
-        tthmatrix1 = np.zeros((len(self.yr), len(self.xr)), dtype=float)
-        tthmatrix1 += ((-self.xr + sourcexr) * sourcexr).reshape(
-            1, len(self.xr)
-        )
-        tthmatrix1 += ((-self.yr + sourceyr) * sourceyr).reshape(
-            len(self.yr), 1
-        )
+        tthmatrix1 = np.zeros((len(yr), len(xr)), dtype=float)
+        tthmatrix1 += ((-xr + sourcexr) * sourcexr).reshape(1, len(xr))
+        tthmatrix1 += ((-yr + sourceyr) * sourceyr).reshape(len(yr), 1)
         tthmatrix1 += sourcezr * sourcezr
-        tthmatrix = np.arccos(tthmatrix1 / self.dmatrix / self.distance)
-        self.tthmatrix = tthmatrix
+        tthmatrix = np.arccos(tthmatrix1 / dmatrix / self.distance)
         return tthmatrix
 
-    def genQMatrix(self):
+    def genQMatrix(self, xr=None, yr=None):
         """Calculate the q matrix.
 
-        :return: 2d array, q value of each pixel's center
+        :param xr: 1d array, x coordinates of pixels, if None, use
+            self.xr (pixel centers)
+        :param yr: 1d array, y coordinates of pixels, if None, use
+            self.yr
+        :return: 2d array, q value of each pixel's center (or each
+            point in xr, yr)
         """
-        sinr = np.sin(-self.rotation)
-        cosr = np.cos(-self.rotation)
-        sint = np.sin(self.tilt)
-        cost = np.cos(self.tilt)
-        sourcexr = -self.distance * sint * cosr
-        sourceyr = self.distance * sint * sinr
-        sourcezr = self.distance * cost
-
-        # tthmatrix1 = np.zeros(
-        #     (self.ydimension, self.xdimension),
-        #     dtype=float,
-        # )
-        tthmatrix1 = np.zeros((len(self.yr), len(self.xr)), dtype=float)
-        tthmatrix1 += ((-self.xr + sourcexr) * sourcexr).reshape(
-            1, len(self.xr)
-        )
-        tthmatrix1 += ((-self.yr + sourceyr) * sourceyr).reshape(
-            len(self.yr), 1
-        )
-        tthmatrix1 += sourcezr * sourcezr
-        tthmatrix = np.arccos(tthmatrix1 / self.dmatrix / self.distance)
-        self.tthmatrix = tthmatrix
+        tthmatrix = self.genTTHMatrix(xr, yr)
         Q = 4 * np.pi * np.sin(tthmatrix / 2.0) / self.wavelength
         return Q
 
@@ -308,8 +1461,7 @@ class Calculate(object):
 
         :return: 2d array, correction matrix to apply on the image
         """
-        rv = self._solidAngleCorrection() * self._polarizationCorrection()
-        return rv
+        return self.correctionmatrix
 
     def _solidAngleCorrection(self):
         """Generate correction matrix of soild angle correction for 2D
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# diffpy.srxplanar  by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2010-2025 Trustees of the Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# File coded by:    Xiaohao Yang
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE.txt for license information.
+#
+##############################################################################
+"""Thin client of the local integration server (see
+diffpy.srxplanar.server).
+
+Only the standard library is imported, so that a call starts fast.
+"""
+
+import argparse
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+
+
+def requestIntegration(request, url="http://127.0.0.1:8765"):
+    """Post an integration request to the server.
+
+    :param request: dict, see server.IntegrationServer.integrate
+    :param url: str, url of the server
+    :return: dict, result of server.IntegrationServer.integrate
+    """
+    req = urllib.request.Request(
+        url.rstrip("/") + "/integrate",
+        data=json.dumps(request).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(req) as f:
+            rv = json.loads(f.read())
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(json.loads(e.read())["error"])
+    return rv
+
+
+def _parseValue(value):
+    """Parse a config value given on the command line, as json if
+    possible (numbers, booleans, lists), else as a string."""
+    try:
+        rv = json.loads(value)
+    except ValueError:
+        rv = value
+    return rv
+
+
+def main():
+    """Integrate image files with a running integration server."""
+    parser = argparse.ArgumentParser(
+        prog="srxplanar-client",
+        description="Integrate image files with srxplanar-server",
+    )
+    parser.add_argument("images", nargs="+", help="image files")
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="OPTION=VALUE",
+        help="config option updated on top of the server config",
+    )
+    args = parser.parse_args()
+    overlay = {}
+    for item in args.set:
+        name, value = item.split("=", 1)
+        overlay[name] = _parseValue(value)
+    for image in args.images:
+        request = {"image": os.path.abspath(image), "config": overlay}
+        try:
+            rv = requestIntegration(request, args.url)
+        except (RuntimeError, OSError) as e:
+            print("%s: %s" % (image, e), file=sys.stderr)
+            return 1
+        print("%s: %s (%.3f s)" % (image, rv["filename"], rv["time"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
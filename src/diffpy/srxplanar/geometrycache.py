@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# diffpy.srxplanar  by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2010-2025 Trustees of the Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# File coded by:    Xiaohao Yang
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE.txt for license information.
+#
+##############################################################################
+"""On-disk cache of geometry matrices and integration tables."""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import scipy.sparse as ssp
+
+from diffpy.srxconfutils.tools import _configPropertyR
+
+# bump this when the content of cached arrays changes
+_cacheversion = 2
+
+
+def _normalize(value):
+    """Convert option value to a json serializable value, so that the
+    same value always gives the same key."""
+    if isinstance(value, (list, tuple, np.ndarray)):
+        rv = [_normalize(v) for v in value]
+    elif isinstance(value, np.generic):
+        rv = value.item()
+    else:
+        rv = value
+    return rv
+
+
+class GeometryCache(object):
+    """Content addressed on-disk cache of arrays used in calculation.
+
+    Each entry is a directory named by the hash of an array name and
+    the values of the options it depends on, and the array is stored as
+    .npy file(s) in it, so that it can be loaded as a memmap. Least
+    recently used entries are removed when the total size exceeds
+    self.cachesize (in MB), entries in use (self.active) are never
+    removed. The cache is disabled if self.cachedirectory is empty.
+    """
+
+    cachedirectory = _configPropertyR("cachedirectory")
+    cachesize = _configPropertyR("cachesize")
+
+    def __init__(self, p):
+        self.config = p
+        # key of the entry last loaded or saved for each array name
+        self.active = {}
+        return
+
+    @property
+    def enabled(self):
+        return self.cachedirectory not in ("", None)
+
+    def genKey(self, name, options):
+        """Generate the key of an array.
+
+        :param name: str, name of array
+        :param options: dict, values of the options the array depends on
+        :return: str, sha1 hash of name and options
+        """
+        values = {k: _normalize(v) for k, v in options.items()}
+        values = [name, values, _cacheversion]
+        s = json.dumps(values, sort_keys=True)
+        return hashlib.sha1(s.encode()).hexdigest()
+
+    def _entryPath(self, key):
+        return os.path.join(self.cachedirectory, key)
+
+    def load(self, name, options):
+        """Load an array (or a sparse matrix) from the cache.
+
+        :param name: str, name of array
+        :param options: dict, values of the options the array depends on
+        :return: np.memmap or scipy.sparse.csc_matrix, None if the array
+            is not cached
+        """
+        if not self.enabled:
+            return None
+        key = self.genKey(name, options)
+        entry = self._entryPath(key)
+        try:
+            if os.path.exists(os.path.join(entry, name + ".indptr.npy")):
+                parts = [
+                    np.load(
+                        os.path.join(entry, "%s.%s.npy" % (name, part)),
+                        mmap_mode="r",
+                    )
+                    for part in ["data", "indices", "indptr", "shape"]
+                ]
+                rv = ssp.csc_matrix(tuple(parts[:3]), shape=tuple(parts[3]))
+            else:
+                rv = np.load(os.path.join(entry, name + ".npy"), mmap_mode="r")
+            # mark the entry as recently used
+            os.utime(entry)
+            self.active[name] = key
+        except (OSError, ValueError):
+            rv = None
+        return rv
+
+    def save(self, name, options, value):
+        """Save an array (or a sparse matrix) to the cache, then evict
+        old entries if the cache is too large.
+
+        :param name: str, name of array
+        :param options: dict, values of the options the array depends on
+        :param value: 2d array or scipy.sparse.csc_matrix
+        :return: None
+        """
+        if not self.enabled:
+            return
+        key = self.genKey(name, options)
+        entry = self._entryPath(key)
+        os.makedirs(entry, exist_ok=True)
+        if ssp.issparse(value):
+            value = ssp.csc_matrix(value)
+            parts = {
+                "data": value.data,
+                "indices": value.indices,
+                "indptr": value.indptr,
+                "shape": np.array(value.shape),
+            }
+            # write indptr last, it marks a complete sparse matrix
+            for part in ["data", "indices", "shape", "indptr"]:
+                self._saveArray(
+                    os.path.join(entry, "%s.%s.npy" % (name, part)),
+                    parts[part],
+                )
+        else:
+            self._saveArray(os.path.join(entry, name + ".npy"), value)
+        self.active[name] = key
+        self.evict()
+        return
+
+    def _saveArray(self, filename, array):
+        """Write array to a temporary file and rename it, so that other
+        processes never see a partially written file."""
+        fd, tmpname = tempfile.mkstemp(
+            dir=os.path.dirname(filename), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.asarray(array))
+            os.replace(tmpname, filename)
+        except OSError:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+        return
+
+    def evict(self):
+        """Remove least recently used entries (never the active ones)
+        until the total size is within self.cachesize (in MB).
+
+        :return: list of str, keys of removed entries
+        """
+        entries = []
+        total = 0
+        for key in os.listdir(self.cachedirectory):
+            path = self._entryPath(key)
+            if not os.path.isdir(path):
+                continue
+            try:
+                size = sum(
+                    os.path.getsize(os.path.join(path, f))
+                    for f in os.listdir(path)
+                )
+                entries.append((os.path.getmtime(path), key, size))
+            except OSError:
+                # removed by another process
+                continue
+            total += size
+        removed = []
+        for mtime, key, size in sorted(entries):
+            if total <= self.cachesize * 1e6:
+                break
+            if key in self.active.values():
+                continue
+            shutil.rmtree(self._entryPath(key), ignore_errors=True)
+            total -= size
+            removed.append(key)
+        return removed
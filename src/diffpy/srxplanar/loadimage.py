@@ -15,6 +15,9 @@
 
 import fnmatch
 import os
+import queue
+import struct
+import threading
 import time
 from pathlib import Path
 
@@ -37,6 +40,137 @@ except ImportError:
         return rv
 
 
+# tags of offsets and byte counts of image data in a tiff file
+_tiffdatatags = [(273, 279), (324, 325)]
+_tifftypes = {3: "H", 4: "I"}
+
+
+def _tiffSize(f):
+    """Get the size of a tiff file from the offsets and byte counts of
+    the image data in its first IFD.
+
+    :param f: file object opened in binary mode
+    :return: int, minimum size of complete file, None if the data
+        location is not found
+    """
+    header = f.read(8)
+    order = {b"II": "<", b"MM": ">"}.get(header[:2])
+    if order is None or struct.unpack(order + "H", header[2:4])[0] != 42:
+        return None
+    f.seek(struct.unpack(order + "I", header[4:8])[0])
+    nentries = struct.unpack(order + "H", f.read(2))[0]
+    entries = f.read(12 * nentries)
+    tags = {}
+    for i in range(nentries):
+        tag, dtype, count, value = struct.unpack(
+            order + "HHI4s", entries[12 * i : 12 * i + 12]
+        )
+        if dtype not in _tifftypes:
+            continue
+        fmt = order + _tifftypes[dtype] * count
+        size = struct.calcsize(fmt)
+        if size > 4:
+            f.seek(struct.unpack(order + "I", value)[0])
+            value = f.read(size)
+        tags[tag] = struct.unpack(fmt, value[:size])
+    rv = None
+    for offsettag, counttag in _tiffdatatags:
+        if offsettag in tags and counttag in tags:
+            rv = max(o + c for o, c in zip(tags[offsettag], tags[counttag]))
+    return rv
+
+
+def expectedSize(filename):
+    """Get the size of a completely written image file from its header.
+
+    :param filename: str or Path, .tif(f) or .npy file
+    :return: int, minimum size of complete file in bytes, None if it
+        cannot be derived from the header of this file format
+    :raise: OSError, ValueError or struct.error if the header is
+        incomplete
+    """
+    suffix = Path(filename).suffix.lower()
+    rv = None
+    with open(filename, "rb") as f:
+        if suffix in (".tif", ".tiff"):
+            rv = _tiffSize(f)
+        elif suffix == ".npy":
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, fortran, dtype = header
+            rv = f.tell() + int(np.prod(shape)) * dtype.itemsize
+    return rv
+
+
+class BufferPool(object):
+    """Pool of preallocated image buffers, so that images loaded one
+    after another (LoadImage.load_image with out) reuse the same memory
+    instead of allocating new arrays.
+
+    A buffer is acquired before an image is loaded into it and released
+    when the image is no longer used. At most self.size buffers are
+    allocated, self.acquire blocks while all of them are in use, so a
+    buffer is never handed out while its image is still in use.
+    """
+
+    def __init__(self, shape, dtype, size=2):
+        """
+        :param shape: tuple, shape of buffers
+        :param dtype: dtype of buffers
+        :param size: int, number of buffers
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.size = max(size, 1)
+        self.buffers = []
+        self.free = queue.Queue()
+        # ids of buffers acquired and not released yet
+        self.inuse = set()
+        self.lock = threading.Lock()
+        return
+
+    def acquire(self):
+        """Get a free buffer, allocated on first use, wait until one is
+        released if all buffers are in use.
+
+        :return: 2d array, content undefined
+        """
+        with self.lock:
+            try:
+                rv = self.free.get_nowait()
+            except queue.Empty:
+                rv = None
+                if len(self.buffers) < self.size:
+                    rv = np.empty(self.shape, dtype=self.dtype)
+                    self.buffers.append(rv)
+            if rv is not None:
+                self.inuse.add(id(rv))
+                return rv
+        rv = self.free.get()
+        with self.lock:
+            self.inuse.add(id(rv))
+        return rv
+
+    def release(self, buffer):
+        """Give back a buffer got from self.acquire, so that it can be
+        reused. Arrays which are not acquired buffers of this pool (e.g.
+        images not loaded through it, or buffers already released) are
+        ignored.
+
+        :param buffer: 2d array
+        :return: None
+        """
+        with self.lock:
+            if id(buffer) not in self.inuse:
+                return
+            self.inuse.discard(id(buffer))
+        self.free.put(buffer)
+        return
+
+
 class LoadImage(object):
     """Provide methods to filter files and load images."""
 
@@ -66,12 +200,39 @@ class LoadImage(object):
             pic = np.array(pic[::-1, :])
         return pic
 
-    def load_image(self, filename):
-        """Load image file. If loading fails (e.g. incomplete file),
-        retry for 5 seconds (10×0.5s).
+    def isReady(self, filename):
+        """Check if an image file looks completely written: its size is
+        at least the size expected from its header, and its size and
+        modification time have not changed for config.readstable
+        seconds.
 
         :param filename: str or Path, image file name or path
-        :return: 2D ndarray, flipped image array
+        :return: bool
+        """
+        readstable = getattr(self.config, "readstable", 0.0)
+        try:
+            stat = os.stat(filename)
+            if time.time() - stat.st_mtime < readstable:
+                return False
+            expected = expectedSize(filename)
+        except (OSError, ValueError, struct.error):
+            # not found or incomplete header
+            return False
+        rv = expected is None or stat.st_size >= expected
+        return rv
+
+    def load_image(self, filename, out=None):
+        """Load image file. Wait until the file is completely written
+        (see self.isReady) and retry if loading fails, with exponential
+        backoff for at most config.readtimeout seconds.
+
+        :param filename: str or Path, image file name or path
+        :param out: 2d array, if provided, the image is flipped and
+            converted to the dtype of out while it is copied into out,
+            and negative counts are clipped in place, so that no other
+            image sized array is allocated (.npy files are memory
+            mapped) (see BufferPool)
+        :return: 2D ndarray, flipped image array (out if provided)
         """
         filenamefull = Path(filename).resolve()
 
@@ -81,19 +242,39 @@ class LoadImage(object):
                 f"Please rerun specifying a valid filename."
             )
 
-        image = np.zeros((100, 100))
-        for _ in range(10):  # retry 10 times (5 seconds total)
-            try:
-                if filenamefull.suffix == ".npy":
-                    image = np.load(filenamefull)
-                else:
-                    image = open_image(filenamefull)
-                break
-            except FileNotFoundError:
-                time.sleep(0.5)
-        image = self.flip_image(image)
-        image[image < 0] = 0
-        return image
+        deadline = time.time() + getattr(self.config, "readtimeout", 5.0)
+        delay = 0.01
+        while True:
+            ready = self.isReady(filenamefull)
+            # not ready in time, try to load it anyway
+            timeout = time.time() + delay > deadline
+            if ready or timeout:
+                try:
+                    image = self._readImage(filenamefull, out is not None)
+                    break
+                except (OSError, ValueError, EOFError):
+                    # e.g. removed or rewritten while reading
+                    if timeout:
+                        raise
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        if out is None:
+            image = self.flip_image(image)
+            image[image < 0] = 0
+            return image
+        v = -1 if self.flipvertical else 1
+        h = -1 if self.fliphorizontal else 1
+        np.copyto(out, image[::v, ::h], casting="unsafe")
+        if out.dtype.kind != "u":
+            np.maximum(out, 0, out=out)
+        return out
+
+    def _readImage(self, filename, mmap=False):
+        if filename.suffix == ".npy":
+            rv = np.load(filename, mmap_mode="r" if mmap else None)
+        else:
+            rv = open_image(filename)
+        return rv
 
     def genFileList(
         self,
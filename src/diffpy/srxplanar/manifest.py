@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# diffpy.srxplanar  by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2010-2025 Trustees of the Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# File coded by:    Xiaohao Yang
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE.txt for license information.
+#
+##############################################################################
+"""Manifest of integrated files, used to skip unchanged files when a
+directory is processed again."""
+
+import hashlib
+import json
+import os
+
+_manifestname = "srxplanar_manifest.jsonl"
+
+
+def fileHash(filename, blocksize=1 << 20):
+    """Get the sha1 hash of the content of a file.
+
+    :param filename: str, path of file
+    :param blocksize: int, size of blocks read at once
+    :return: str, hex digest
+    """
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class Manifest(object):
+    """Record of the source files integrated into a save directory.
+
+    Each record holds the size and modification time (and optionally
+    the content hash) of the source file, the fingerprint of the config
+    used and the saved file. A file is up to date if all of them are
+    unchanged and the saved file exists. Records are appended to a json
+    lines file as soon as each file is integrated, so an interrupted run
+    keeps the records of the files already done, the last record of a
+    file wins.
+    """
+
+    def __init__(self, savedirectory, fingerprint, usehash=False):
+        """
+        :param savedirectory: str, directory of the saved results, the
+            manifest is stored in it
+        :param fingerprint: str, fingerprint of the config, see
+            SrXplanar.configFingerprint
+        :param usehash: bool, also compare the content hash of files
+        """
+        self.filename = os.path.join(savedirectory, _manifestname)
+        self.fingerprint = fingerprint
+        self.usehash = usehash
+        self.records = {}
+        if os.path.exists(self.filename):
+            with open(self.filename) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # truncated last line of an interrupted run
+                        continue
+                    self.records[record["path"]] = record
+        return
+
+    def fileState(self, path):
+        """Get the size, modification time (and hash) of a file.
+
+        :param path: str, path of file
+        :return: dict
+        """
+        stat = os.stat(path)
+        rv = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+        if self.usehash:
+            rv["hash"] = fileHash(path)
+        return rv
+
+    def isUpToDate(self, path, state=None):
+        """Check if a file was integrated with the current config and
+        has not changed since.
+
+        :param path: str, path of source file
+        :param state: dict, result of self.fileState(path), if None,
+            get it now
+        :return: bool
+        """
+        record = self.records.get(os.path.abspath(path))
+        if record is None or record["fingerprint"] != self.fingerprint:
+            return False
+        if not all(os.path.exists(f) for f in record["output"]):
+            return False
+        try:
+            state = self.fileState(path) if state is None else state
+        except OSError:
+            return False
+        rv = all(record.get(k) == v for k, v in state.items())
+        return rv
+
+    def record(self, path, output, state=None):
+        """Record that a file has been integrated.
+
+        :param path: str, path of source file
+        :param output: str or list of str, saved file(s)
+        :param state: dict, size/mtime(/hash) of the source file when it
+            was read, if None, get it now
+        :return: None
+        """
+        record = {"path": os.path.abspath(path)}
+        record.update(self.fileState(path) if state is None else state)
+        record["fingerprint"] = self.fingerprint
+        record["output"] = [output] if isinstance(output, str) else output
+        self.records[record["path"]] = record
+        with open(self.filename, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        return
@@ -60,6 +60,7 @@ class Mask(object):
     darkpixelmask = _configPropertyR("darkpixelmask")
     cropedges = _configPropertyR("cropedges")
     avgmask = _configPropertyR("avgmask")
+    integrationstatistic = _configPropertyR("integrationstatistic")
 
     def __init__(self, p, calculate):
         self.config = p
@@ -113,7 +114,10 @@ class Mask(object):
         :param darkpixelmask: pixels with much higher intensity compare
             to adjacent pixels will be masked
         :param avgmask: Mask the pixels too bright or too dark compared
-            to the average intensity at the similar diffraction angle
+            to the average intensity at the similar diffraction angle,
+            if None, use self.avgmask, but skip it if a robust
+            integrationstatistic is used, which rejects such pixels in
+            integration
         :return: 2d array of boolean, 1 stands for masked pixel
         """
 
@@ -125,7 +129,8 @@ class Mask(object):
         darkpixelmask = (
             self.darkpixelmask if darkpixelmask is None else darkpixelmask
         )
-        avgmask = self.avgmask if avgmask is None else avgmask
+        if avgmask is None:
+            avgmask = self.avgmask and self.integrationstatistic == "mean"
 
         if darkpixelmask or brightpixelmask or avgmask:
             rv = np.zeros((self.ydimension, self.xdimension))
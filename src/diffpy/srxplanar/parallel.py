@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# diffpy.srxplanar  by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2010-2025 Trustees of the Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# File coded by:    Xiaohao Yang
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE.txt for license information.
+#
+##############################################################################
+"""Helpers to share arrays with worker processes and to limit the
+threads of each worker."""
+
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+import scipy.sparse as ssp
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+# environment variables setting the number of BLAS/OpenMP threads
+_threadsenv = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]
+
+
+class SharedArrays(object):
+    """Arrays shared with worker processes through memory mapped files.
+
+    Each array (or the parts of a sparse matrix) is written once to a
+    .npy file in a temporary directory, in /dev/shm if it exists so
+    that the files stay in memory. Workers load them as memmaps with
+    attachArrays, so all processes map the same pages instead of
+    copying or recomputing the arrays. The files are removed by
+    self.close, or on exit if it is used as a context manager.
+    """
+
+    def __init__(self, arrays):
+        """
+        :param arrays: dict, name -> array or scipy.sparse matrix
+        """
+        shmdir = "/dev/shm"
+        shmdir = shmdir if os.path.isdir(shmdir) else None
+        self.directory = tempfile.mkdtemp(prefix="srxplanar", dir=shmdir)
+        # name -> (list of .npy files, shape of sparse matrix or None)
+        self.descriptors = {}
+        for name, value in arrays.items():
+            if ssp.issparse(value):
+                value = ssp.csc_matrix(value)
+                parts = {
+                    "data": value.data,
+                    "indices": value.indices,
+                    "indptr": value.indptr,
+                }
+                filenames = [
+                    self._saveArray("%s.%s" % (name, part), parts[part])
+                    for part in ["data", "indices", "indptr"]
+                ]
+                self.descriptors[name] = (filenames, value.shape)
+            else:
+                filename = self._saveArray(name, value)
+                self.descriptors[name] = ([filename], None)
+        return
+
+    def _saveArray(self, name, array):
+        filename = os.path.join(self.directory, name + ".npy")
+        np.save(filename, np.asarray(array))
+        return filename
+
+    def close(self):
+        """Remove the files, workers that already loaded the arrays
+        keep their mapping."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return
+
+
+def attachArrays(descriptors):
+    """Load arrays shared by SharedArrays.
+
+    :param descriptors: dict, SharedArrays.descriptors
+    :return: dict, name -> np.memmap or scipy.sparse.csc_matrix
+    """
+    rv = {}
+    for name, (filenames, shape) in descriptors.items():
+        parts = [np.load(f, mmap_mode="r") for f in filenames]
+        if shape is None:
+            rv[name] = parts[0]
+        else:
+            rv[name] = ssp.csc_matrix(tuple(parts), shape=tuple(shape))
+    return rv
+
+
+@contextmanager
+def singleThreadEnv():
+    """Set the BLAS/OpenMP thread counts to 1 in the environment (unless
+    they are set already) while worker processes are started, so that
+    they are inherited by the workers."""
+    old = {name: os.environ.get(name) for name in _threadsenv}
+    for name in _threadsenv:
+        os.environ.setdefault(name, "1")
+    try:
+        yield
+    finally:
+        for name, value in old.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def limitWorkerThreads():
+    """Limit the threads of BLAS/OpenMP libraries already loaded in a
+    worker process (e.g. inherited by fork) to 1, if threadpoolctl is
+    installed.
+
+    :return: threadpoolctl limiter (keep a reference), or None
+    """
+    rv = None
+    if threadpool_limits is not None:
+        rv = threadpool_limits(limits=1)
+    return rv
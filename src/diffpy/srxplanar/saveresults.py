@@ -64,11 +64,14 @@ class SaveResults(object):
             intensity) or (3, len of intensity) file name is generated
             according to original file name and savedirectory
         """
-        rv = self.saveChi(rv["chi"], rv["filename"])
+        filepath = self.saveChi(rv["chi"], rv["filename"])
         if self.gsasoutput:
             if self.gsasoutput in set(["std", "esd", "fxye"]):
-                rv = [rv, self.saveGSAS(rv["chi"], rv["filename"])]
-        return rv
+                filepath = [
+                    filepath,
+                    self.saveGSAS(rv["chi"], rv["filename"]),
+                ]
+        return filepath
 
     def saveChi(self, xrd, filename):
         """Save diffraction intensity in .chi.
@@ -78,13 +81,30 @@ class SaveResults(object):
         :param filename: str, base file name
         """
         filepath = self.getFilePathWithoutExt(filename) + ".chi"
-        f = open(filepath, "wb")
+        f = open(filepath, "w")
         f.write(self.config.getHeader(mode="short"))
         f.write("#### start data\n")
         np.savetxt(f, xrd.transpose(), fmt="%g")
         f.close()
         return filepath
 
+    def saveCake(self, rv):
+        """Save 2d caked pattern in .npz.
+
+        :param rv: dict, result of 2d caking, include 'cake', 'count',
+            'xgrid', 'azimuthgrid' and 'filename' (base file name)
+        :return: str, path of saved file
+        """
+        filepath = self.getFilePathWithoutExt(rv["filename"]) + "_cake.npz"
+        np.savez(
+            filepath,
+            cake=rv["cake"],
+            count=rv["count"],
+            xgrid=rv["xgrid"],
+            azimuthgrid=rv["azimuthgrid"],
+        )
+        return filepath
+
     def saveGSAS(self, xrd, filename):
         """Save diffraction intensity in gsas format.
 
@@ -93,7 +113,7 @@ class SaveResults(object):
         :param filename: str, base file name
         """
         filepath = self.getFilePathWithoutExt(filename) + ".gsas"
-        f = open(filepath, "wb")
+        f = open(filepath, "w")
         f.write(self.config.getHeader(mode="short"))
         f.write("#### start data\n")
         if xrd.shape[0] == 3:
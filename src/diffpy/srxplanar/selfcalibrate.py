@@ -51,29 +51,34 @@ def halfcut(
         pass
 
     srx.prepareCalculation()
-    kwargs = {
-        "savename": None,
-        "savefile": False,
-        "flip": False,
-        "correction": False,
-    }
+    # integrate all halves in one pass, left/right halves are split at
+    # xycenter[0], up/down halves are split at xycenter[1]
+    shape = (srx.config.ydimension, srx.config.xdimension)
+    x = np.arange(shape[1]).reshape(1, shape[1])
+    y = np.arange(shape[0]).reshape(shape[0], 1)
+    regions = []
     if mode != "y":
-        srx.config.extracrop = [1, srx.config.xdimension - xycenter[0], 1, 1]
-        res1 = srx.integrate(image, **kwargs)
+        regions.extend([x < xycenter[0], x >= xycenter[0]])
+    if mode != "x":
+        regions.extend([y < xycenter[1], y >= xycenter[1]])
+    regions = [np.broadcast_to(region, shape) for region in regions]
+    res = srx.integrateLabels(image, regions, flip=False, correction=False)
+    chis = [
+        {"chi": np.vstack([res["xgrid"], intensity])}
+        for intensity in res["intensity"]
+    ]
+    if mode != "y":
+        res1, res2 = chis[:2]
         chi1 = res1["chi"][1][qind[0] : qind[1]]
-
-        srx.config.extracrop = [xycenter[0], 1, 1, 1]
-        res2 = srx.integrate(image, **kwargs)
         chi2 = res2["chi"][1][qind[0] : qind[1]]
-
+    else:
+        res1 = res2 = None
     if mode != "x":
-        srx.config.extracrop = [1, 1, 1, srx.config.ydimension - xycenter[1]]
-        res3 = srx.integrate(image, **kwargs)
+        res3, res4 = chis[-2:]
         chi3 = res3["chi"][1][qind[0] : qind[1]]
-
-        srx.config.extracrop = [1, 1, xycenter[1], 1]
-        res4 = srx.integrate(image, **kwargs)
         chi4 = res4["chi"][1][qind[0] : qind[1]]
+    else:
+        res3 = res4 = None
 
     if mode == "x":
         rv = chi1 - chi2
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# diffpy.srxplanar  by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2010-2025 Trustees of the Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# File coded by:    Xiaohao Yang
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE.txt for license information.
+#
+##############################################################################
+"""Local integration server keeping configured SrXplanar instances (and
+their geometry) warm across requests.
+
+Requests are JSON objects posted to http://host:port/integrate, see
+IntegrationServer.integrate, diffpy.srxplanar.client is a thin client.
+"""
+
+import argparse
+import base64
+import collections
+import copy
+import json
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from diffpy.srxplanar.srxplanar import SrXplanar
+from diffpy.srxplanar.srxplanarconfig import SrXplanarConfig
+
+
+class IntegrationServer(object):
+    """Hold SrXplanar instances keyed by config overlay and integrate
+    images with them.
+
+    Each distinct overlay (options updated on top of the base config)
+    gets its own instance, prepared once and reused by later requests
+    with the same overlay. At most maxinstances instances are kept, the
+    least recently used one is dropped first. Requests to the same
+    instance are integrated one at a time.
+    """
+
+    def __init__(self, config=None, maxinstances=4):
+        """
+        :param config: SrXplanarConfig, base config, if None, use the
+            default config
+        :param maxinstances: int, maximum number of instances kept
+        """
+        self.config = SrXplanarConfig() if config is None else config
+        self.maxinstances = maxinstances
+        self.options = set(opt[0] for opt in self.config._optdatalist)
+        # key -> Future of (SrXplanar, lock), set once prepared
+        self.instances = collections.OrderedDict()
+        self.lock = threading.Lock()
+        return
+
+    def getInstance(self, overlay=None):
+        """Get the instance of a config overlay, create and prepare it
+        if it does not exist.
+
+        The instance is prepared outside self.lock, so requests to other
+        instances are not blocked. Requests to an instance being
+        prepared wait for it, if preparing fails, they get the error and
+        the next request tries again.
+
+        :param overlay: dict, option name -> value, updated on top of
+            the base config
+        :return: tuple, (SrXplanar, threading.Lock of the instance)
+        """
+        overlay = {} if overlay is None else overlay
+        unknown = set(overlay) - self.options
+        if unknown:
+            raise ValueError("unknown options: %s" % ", ".join(unknown))
+        key = json.dumps(overlay, sort_keys=True)
+        with self.lock:
+            future = self.instances.get(key)
+            create = future is None
+            if create:
+                future = Future()
+                self.instances[key] = future
+                while len(self.instances) > self.maxinstances:
+                    self.instances.popitem(last=False)
+            else:
+                self.instances.move_to_end(key)
+        if create:
+            try:
+                srx = SrXplanar(srxplanarconfig=copy.deepcopy(self.config))
+                srx.updateConfig(**overlay)
+                srx.prepareCalculation()
+            except BaseException as e:
+                with self.lock:
+                    if self.instances.get(key) is future:
+                        del self.instances[key]
+                future.set_exception(e)
+                raise
+            future.set_result((srx, threading.Lock()))
+        rv = future.result()
+        return rv
+
+    def integrate(self, request):
+        """Integrate an image.
+
+        :param request: dict, with keys
+            'image': str, path of image file on the server host, or
+            'array': dict of 'data' (base64 encoded bytes), 'dtype' and
+            'shape' of a 2d array, and optional keys
+            'config': dict, config overlay,
+            'savefile', 'savename', 'flip', 'correction': passed to
+            SrXplanar.integrate
+        :return: dict, 'chi' (list of lists), 'filename' and 'time'
+            (seconds spent in integration)
+        """
+        srx, lock = self.getInstance(request.get("config"))
+        if "array" in request:
+            array = request["array"]
+            # copy, the image may be corrected in place
+            image = np.frombuffer(
+                base64.b64decode(array["data"]), dtype=array["dtype"]
+            )
+            image = image.reshape(array["shape"]).copy()
+        else:
+            image = request["image"]
+        kwargs = {
+            k: request[k]
+            for k in ["savefile", "savename", "flip", "correction"]
+            if k in request
+        }
+        with lock:
+            t0 = time.time()
+            rv = srx.integrate(image, **kwargs)
+            t1 = time.time()
+        rv = {
+            "chi": np.asarray(rv["chi"]).tolist(),
+            "filename": rv["filename"],
+            "time": t1 - t0,
+        }
+        return rv
+
+    def status(self):
+        """Get the overlays of the instances kept by the server.
+
+        :return: dict
+        """
+        with self.lock:
+            rv = {"instances": [json.loads(k) for k in self.instances]}
+        return rv
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """HTTP handler calling self.server.integrationserver."""
+
+    def _reply(self, code, rv):
+        body = json.dumps(rv).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return
+
+    def do_GET(self):
+        if self.path == "/status":
+            self._reply(200, self.server.integrationserver.status())
+        else:
+            self._reply(404, {"error": "not found: %s" % self.path})
+        return
+
+    def do_POST(self):
+        if self.path != "/integrate":
+            self._reply(404, {"error": "not found: %s" % self.path})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            rv = self.server.integrationserver.integrate(request)
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            self._reply(400, {"error": "%s: %s" % (type(e).__name__, e)})
+        except Exception as e:
+            # keep the connection answered, the client gets the error
+            self._reply(500, {"error": "%s: %s" % (type(e).__name__, e)})
+        else:
+            self._reply(200, rv)
+        return
+
+    def log_message(self, format, *args):
+        # keep the console quiet, one line per request is too much at
+        # one request per exposure
+        return
+
+
+def createServer(integrationserver, host="127.0.0.1", port=8765):
+    """Create the HTTP server of an IntegrationServer, call
+    serve_forever() on the result to run it.
+
+    :param integrationserver: IntegrationServer
+    :param host: str, address to bind, localhost by default
+    :param port: int, port to bind, 0 for any free port
+    :return: http.server.ThreadingHTTPServer
+    """
+    rv = ThreadingHTTPServer((host, port), _RequestHandler)
+    rv.integrationserver = integrationserver
+    return rv
+
+
+def main():
+    """Run a local integration server."""
+    parser = argparse.ArgumentParser(
+        prog="srxplanar-server",
+        description=(
+            "Local integration server, keeps configured SrXplanar"
+            " instances warm and integrates images posted by"
+            " srxplanar-client"
+        ),
+    )
+    parser.add_argument("configfile", nargs="?", help="base config file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--maxinstances",
+        type=int,
+        default=4,
+        help="maximum number of configured instances kept",
+    )
+    args = parser.parse_args()
+    config = SrXplanarConfig(filename=args.configfile)
+    server = createServer(
+        IntegrationServer(config, args.maxinstances), args.host, args.port
+    )
+    print("Serving on http://%s:%d" % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,16 +14,33 @@
 ##############################################################################
 """Srxplanar main modular."""
 
+import asyncio
+import collections
+import copy
+import hashlib
 import os
+import queue
 import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import numpy as np
 
+from diffpy.srxplanar.accumulator import IntegrationAccumulator
 from diffpy.srxplanar.calculate import Calculate
-from diffpy.srxplanar.loadimage import LoadImage
+from diffpy.srxplanar.loadimage import BufferPool, LoadImage
+from diffpy.srxplanar.manifest import Manifest
 from diffpy.srxplanar.mask import Mask
+from diffpy.srxplanar.parallel import (
+    SharedArrays,
+    attachArrays,
+    limitWorkerThreads,
+    singleThreadEnv,
+)
 from diffpy.srxplanar.saveresults import SaveResults
 from diffpy.srxplanar.srxplanarconfig import SrXplanarConfig
+from diffpy.srxplanar.workqueue import WorkQueue
 
 # import time
 
@@ -59,6 +76,10 @@ class SrXplanar(object):
         self.calculate = Calculate(self.config)
         self.mask = Mask(self.config, self.calculate)
         self.saveresults = SaveResults(self.config)
+        # used by the async API
+        self._integratelock = threading.Lock()
+        self._asyncsemaphore = None
+        self.bufferpool = None
         return
 
     def updateConfig(self, filename=None, args=None, **kwargs):
@@ -88,6 +109,8 @@ class SrXplanar(object):
         self.correction = self.calculate.genCorrectionMatrix()
         self.staticmask = np.logical_or(self.mask.edgeMask(), self.staticmask)
         self.calculate.genIntegrationInds(self.staticmask)
+        self.integrationmask = self.staticmask
+        self.calculate.resetGain()
         return
 
     def _picChanged(self, extramask=None):
@@ -108,8 +131,11 @@ class SrXplanar(object):
         else:
             mask = self.staticmask
 
-        if (dynamicmask is not None) or (extramask is not None):
+        # also regenerate when going back to the static mask after an
+        # image integrated with a dynamic or extra mask
+        if mask is not self.integrationmask:
             self.calculate.genIntegrationInds(mask)
+            self.integrationmask = mask
         return
 
     def _getSaveFileName(self, imagename=None, filename=None):
@@ -147,33 +173,73 @@ class SrXplanar(object):
             if None: correct on the string/list of string,
             not correct on the 2d array
 
-        :return: 2d array of image
+        :return: 2d array of image, self.picframes is the number of
+            images averaged in it
         """
+        dtype = self.calculate.dtype
         if isinstance(image, list):
-            rv = np.zeros((self.config.ydimension, self.config.xdimension))
-            for imagefile in image:
-                rv += self._getPic(imagefile)
-            rv /= len(image)
-        elif isinstance(image, str):
-            rv = self.loadimage.load_image(image)
-            if correction is None or correction is True:
-                ce = self.config.cropedges
-                rv[ce[2] : -ce[3], ce[0] : -ce[1]] = (
-                    rv[ce[2] : -ce[3], ce[0] : -ce[1]] * self.correction
-                )
-                # rv *= self.correction
+            # the correction is linear, apply it once to the average
+            rv = self._averageImages(image)
+            correction = correction is None or correction is True
+            rv = self._getPic(rv, flip=False, correction=correction)
+            self.picframes = len(image)
         else:
-            rv = image
-            if flip is True:
-                rv = self.loadimage.flip_image(rv)
-            if correction is True:
-                # rv *= self.correction
+            if isinstance(image, str):
+                rv = self._loadImage(image)
+                correction = correction is None or correction is True
+            else:
+                rv = image
+                if flip is True:
+                    rv = self.loadimage.flip_image(rv)
+                correction = correction is True
+            # convert before correction, so that corrected counts are
+            # not truncated to integers
+            if rv.dtype.kind != "f" or rv.dtype.itemsize > dtype.itemsize:
+                rv = rv.astype(dtype)
+            if correction:
                 ce = self.config.cropedges
-                rv[ce[2] : -ce[3], ce[0] : -ce[1]] = (
-                    rv[ce[2] : -ce[3], ce[0] : -ce[1]] * self.correction
-                )
-        if rv.dtype.kind != "f":
-            rv = rv.astype(float)
+                view = rv[ce[2] : -ce[3], ce[0] : -ce[1]]
+
+                def correctBlock(r0, r1):
+                    view[r0:r1] *= self.correction[r0:r1]
+                    return
+
+                self.calculate.runBlocks(correctBlock, len(view))
+            self.piccorrected = correction
+            self.picframes = 1
+        return rv
+
+    def _averageImages(self, filelist):
+        """Average image files, decoded in parallel by
+        self.config.prefetch threads (at least 1) into reused buffers
+        and accumulated in place in one float64 buffer.
+
+        :param filelist: list of str, image files
+        :return: 2d array, average of (flipped) images, not corrected
+        """
+        rv = np.zeros((self.config.ydimension, self.config.xdimension))
+        nthreads = max(self.config.prefetch, 1)
+        # one buffer for each image being decoded or waiting to be added
+        buffers = BufferPool(rv.shape, rv.dtype, nthreads)
+
+        def load(imagefile):
+            return self.loadimage.load_image(imagefile, out=buffers.acquire())
+
+        def add(future):
+            pic = future.result()
+            np.add(rv, pic, out=rv)
+            buffers.release(pic)
+            return
+
+        pending = collections.deque()
+        with ThreadPoolExecutor(nthreads) as pool:
+            for imagefile in filelist:
+                pending.append(pool.submit(load, imagefile))
+                if len(pending) >= nthreads:
+                    add(pending.popleft())
+            while pending:
+                add(pending.popleft())
+        rv /= len(filelist)
         return rv
 
     def integrate(
@@ -215,14 +281,230 @@ class SrXplanar(object):
         rv["filename"] = self._getSaveFileName(
             imagename=image, filename=savename
         )
-        self._picChanged(extramask=extramask)
-        # calculate
-        rv["chi"] = self.chi = self.calculate.intensity(self.pic)
+        try:
+            self._picChanged(extramask=extramask)
+            # calculate
+            rv["chi"] = self.chi = self.calculate.intensity(
+                self.pic,
+                self.correction if self.piccorrected else None,
+                self.picframes,
+            )
+        finally:
+            self._releaseBuffer(self.pic)
         # save
         if savefile:
             rv["filename"] = self.saveresults.save(rv)
         return rv
 
+    def integrate2D(
+        self,
+        image,
+        savename=None,
+        savefile=True,
+        flip=None,
+        correction=None,
+        extramask=None,
+    ):
+        """Integrate 2d image to 2d caked pattern (azimuth, tth or q),
+        then save to disk.
+
+        :param image: str or 2d array, see self.integrate
+        :param savename: str, name of file to save
+        :param savefile: boolean, if True, save file to disk (.npz),
+        if False, do not save file to disk
+        :param flip: flip the image/2d array, see self.integrate
+        :param correction: apply correction, see self.integrate
+        :param extramask: 2d array, extra mask applied in integration
+
+        :return: dict, rv['cake'] is a 2d array of integrated intensity,
+            shape is (len of azimuthgrid, len of xgrid), rv['count'] is
+            the number of pixels in each bin, rv['xgrid'] is the tth or
+            q grid, rv['azimuthgrid'] is the azimuthal angle grid (in
+            degrees). rv['filename'] is the name of file to save to disk
+        """
+        rv = {}
+        self.pic = self._getPic(image, flip, correction)
+
+        rv["filename"] = self._getSaveFileName(
+            imagename=image, filename=savename
+        )
+        try:
+            self._picChanged(extramask=extramask)
+            # calculate
+            rv["cake"], rv["count"] = self.calculate.intensity2D(self.pic)
+        finally:
+            self._releaseBuffer(self.pic)
+        rv["xgrid"] = self.calculate.xgrid
+        rv["azimuthgrid"] = self.calculate.azimuthgrid
+        # save
+        if savefile:
+            rv["filename"] = self.saveresults.saveCake(rv)
+        return rv
+
+    def integrateLabels(
+        self, image, labels, flip=None, correction=None, extramask=None
+    ):
+        """Integrate several regions (such as sectors, halves or panels)
+        of 2d image to 1d diffraction patterns in one pass.
+
+        :param image: str or 2d array, see self.integrate
+        :param labels: 2d int array or list of 2d bool arrays, regions
+            to integrate, see Calculate.intensityLabels
+        :param flip: flip the image/2d array, see self.integrate
+        :param correction: apply correction, see self.integrate
+        :param extramask: 2d array, extra mask applied in integration
+
+        :return: dict, rv['xgrid'] is a 1d array of tth or q,
+            rv['intensity'] is a 2d array of integrated intensity, shape
+            is (number of regions, len of xgrid), rv['count'] is the
+            number of pixels in each bin
+        """
+        self.pic = self._getPic(image, flip, correction)
+        try:
+            self._picChanged(extramask=extramask)
+            intensity, count = self.calculate.intensityLabels(self.pic, labels)
+        finally:
+            self._releaseBuffer(self.pic)
+        rv = {
+            "xgrid": self.calculate.xgrid,
+            "intensity": intensity,
+            "count": count,
+        }
+        return rv
+
+    def integrateStatistics(
+        self, image, flip=None, correction=None, extramask=None
+    ):
+        """Integrate 2d image to per bin statistics (sum, sum of
+        squares, min, max, count, mean, variance and standard error) in
+        one pass over the image.
+
+        :param image: str or 2d array, see self.integrate
+        :param flip: flip the image/2d array, see self.integrate
+        :param correction: apply correction, see self.integrate
+        :param extramask: 2d array, extra mask applied in integration
+
+        :return: dict, rv['xgrid'] is a 1d array of tth or q, other
+            items are 1d arrays of statistics, see
+            Calculate.intensityStatistics
+        """
+        self.pic = self._getPic(image, flip, correction)
+        try:
+            self._picChanged(extramask=extramask)
+            rv = self.calculate.intensityStatistics(self.pic)
+        finally:
+            self._releaseBuffer(self.pic)
+        rv["xgrid"] = self.calculate.xgrid
+        return rv
+
+    def precisionReport(
+        self, image, flip=None, correction=None, extramask=None
+    ):
+        """Integrate the image in both float64 and float32 precision and
+        report the deviation of float32 results from float64 results.
+        The precision in self.config is restored afterwards.
+
+        :param image: str or 2d array, image to be integrated, see
+            self.integrate
+        :param flip: flip the image/2d array, see self.integrate
+        :param correction: apply correction, see self.integrate
+        :param extramask: 2d array, extra mask applied in integration
+
+        :return: dict, for 'intensity' and 'uncertainty' (if enabled), a
+            dict of 'maxabs' (max absolute deviation), 'maxrel' (max
+            deviation relative to the float64 value) and 'rms' (root
+            mean square deviation relative to the mean float64 value)
+        """
+        precision = self.config.precision
+        chi = {}
+        try:
+            for p in ["float64", "float32"]:
+                self.updateConfig(precision=p)
+                self.prepareCalculation()
+                pic = image if isinstance(image, str) else np.array(image)
+                chi[p] = self.integrate(
+                    pic,
+                    savefile=False,
+                    flip=flip,
+                    correction=correction,
+                    extramask=extramask,
+                )["chi"]
+        finally:
+            self.updateConfig(precision=precision)
+            self.prepareCalculation()
+
+        rv = {}
+        names = ["intensity", "uncertainty"][: len(chi["float64"]) - 1]
+        for i, name in enumerate(names, 1):
+            ref = chi["float64"][i]
+            diff = np.abs(chi["float32"][i] - ref)
+            nonzero = ref != 0
+            # relative deviations are 0 if all float64 values are 0
+            maxrel = 0.0
+            rms = 0.0
+            if np.any(nonzero):
+                maxrel = (diff[nonzero] / np.abs(ref[nonzero])).max()
+                rms = np.sqrt(np.mean(diff**2)) / np.abs(ref).mean()
+            rv[name] = {"maxabs": diff.max(), "maxrel": maxrel, "rms": rms}
+        return rv
+
+    def integrateStack(
+        self,
+        stack,
+        flip=None,
+        correction=None,
+        extramask=None,
+        chunksize=16,
+    ):
+        """Integrate a stack of 2d images sharing the same geometry to
+        1d diffraction patterns. Images are integrated in batches over
+        the shared geometry instead of one by one. The mask is
+        generated once, dynamic masks are generated using the first
+        image and applied to all images in the stack.
+
+        :param stack: 3d array (N, ydimension, xdimension) or str,
+            if 3d array (could be a np.memmap), integrate this stack.
+            if str, load the stack from this .npy file as a memmap
+        :param flip: flip the images, if None: not flip (same as the
+            2d array in self.integrate).
+            Flip behavior is controlled in self.config
+        :param correction: apply correction to the images, if None: not
+            correct (same as the 2d array in self.integrate)
+        :param extramask: 2d array, extra mask applied in integration
+        :param chunksize: int, number of images integrated in one batch
+
+        :return: dict, rv['xgrid'] is a 1d array of tth or q,
+            rv['intensity'] is a 2d array of integrated intensity, shape
+            is (N, len of intensity). rv['uncertainty'] has the same
+            shape as rv['intensity'] or is None if uncertainty is
+            disabled
+        """
+        if isinstance(stack, str):
+            stack = np.load(stack, mmap_mode="r")
+        if flip is True:
+            # use views so that the stack is not copied
+            if self.config.fliphorizontal:
+                stack = stack[:, :, ::-1]
+            if self.config.flipvertical:
+                stack = stack[:, ::-1, :]
+
+        if len(stack) > 0:
+            self.pic = self._getPic(
+                np.array(stack[0], dtype=float), correction=correction
+            )
+            self._picChanged(extramask=extramask)
+        chi = self.calculate.intensityStack(
+            stack,
+            correction=self.correction if correction is True else None,
+            chunksize=chunksize,
+        )
+        rv = {
+            "xgrid": self.calculate.xgrid,
+            "intensity": chi[:, 1],
+            "uncertainty": chi[:, 2] if chi.shape[1] == 3 else None,
+        }
+        return rv
+
     def integrateFilelist(
         self,
         filelist,
@@ -255,37 +537,497 @@ class SrXplanar(object):
         """
         summation = self.config.summation if summation is None else summation
         if (summation) and (len(filelist) > 1):
-            image = self._getPic(filelist, flip, correction)
             if filename is None:
                 if isinstance(filelist[-1], str):
                     filename = os.path.splitext(filelist[-1])[0] + "_sum.chi"
                 else:
                     filename = "Sum_xrd.chi"
+            # integrate the list, so that the number of averaged frames
+            # and the correction are known in the uncertainty
             rv = [
-                self.integrate(image, savename=filename, extramask=extramask)
+                self.integrate(
+                    filelist,
+                    savename=filename,
+                    flip=flip,
+                    correction=correction,
+                    extramask=extramask,
+                )
             ]
         else:
-            i = 0
+            manifest = None
+            if self.config.incremental:
+                # skip files integrated before with the same config
+                manifest = Manifest(
+                    self.config.savedirectory,
+                    self.configFingerprint(),
+                    self.config.manifesthash,
+                )
+                states = [manifest.fileState(f) for f in filelist]
+                changed = [
+                    i
+                    for i, f in enumerate(filelist)
+                    if not manifest.isUpToDate(f, states[i])
+                ]
+                filelist = [filelist[i] for i in changed]
+                states = [states[i] for i in changed]
+            args = (filelist, filename, flip, correction, extramask)
+            if self.config.jobs > 1 and len(filelist) > 1:
+                results = self._iterParallel(*args)
+            else:
+                results = self.iterIntegrate(*args)
             rv = []
+            for i, rvv in enumerate(results):
+                if manifest is not None:
+                    manifest.record(filelist[i], rvv["filename"], states[i])
+                rv.append(rvv)
+        return rv
+
+    def accumulate(
+        self,
+        image,
+        accumulator=None,
+        flip=None,
+        correction=None,
+        extramask=None,
+    ):
+        """Integrate an image and add its per bin sums to an
+        accumulator, see Calculate.binSums. Only the 'mean'
+        integrationstatistic is supported.
+
+        :param image: str or 2d array, same as self.integrate
+        :param accumulator: IntegrationAccumulator, if None, create a
+            new one
+        :param flip: same as self.integrate
+        :param correction: same as self.integrate
+        :param extramask: 2d array, extra mask applied in integration
+        :return: IntegrationAccumulator, accumulator including image
+        """
+        self.pic = self._getPic(image, flip, correction)
+        try:
+            self._picChanged(extramask=extramask)
+            sums = self.calculate.binSums(
+                self.pic, self.correction if self.piccorrected else None
+            )
+        finally:
+            self._releaseBuffer(self.pic)
+        if accumulator is None:
+            accumulator = IntegrationAccumulator(self.calculate.xgrid)
+        accumulator.add(*sums)
+        return accumulator
+
+    def accumulateFilelist(
+        self, filelist, flip=None, correction=None, extramask=None
+    ):
+        """Accumulate the per bin sums of all files in filelist, split
+        into self.config.jobs parts accumulated by separate workers and
+        then merged.
+
+        :param filelist: list of str, files to be integrated
+        :param flip: same as self.integrate
+        :param correction: same as self.integrate
+        :param extramask: 2d array, extra mask applied in integration
+        :return: IntegrationAccumulator, rv.result() gives the pattern
+        """
+        rv = IntegrationAccumulator(self.calculate.xgrid)
+        if self.config.jobs > 1 and len(filelist) > 1:
+            kwargs = {
+                "flip": flip,
+                "correction": correction,
+                "extramask": extramask,
+            }
+            jobs = min(self.config.jobs, len(filelist))
+            bounds = np.linspace(0, len(filelist), jobs + 1).astype(int)
+            parts = [filelist[i0:i1] for i0, i1 in zip(bounds, bounds[1:])]
+            for accumulator in self._mapWorkers(
+                _accumulateInWorker, parts, kwargs
+            ):
+                rv.merge(accumulator)
+        else:
             for imagefile in filelist:
-                if filename is None:
-                    rvv = self.integrate(
-                        imagefile,
-                        flip=flip,
-                        correction=correction,
-                        extramask=extramask,
-                    )
-                else:
-                    rvv = self.integrate(
-                        imagefile,
-                        savename=filename + "%03d" % i,
+                self.accumulate(imagefile, rv, flip, correction, extramask)
+        return rv
+
+    def configFingerprint(self):
+        """Get a fingerprint of the config options that change the
+        results (the options in the header of saved files) and of the
+        mask file.
+
+        :return: str, sha1 hex digest
+        """
+        h = hashlib.sha1(self.config.getHeader(mode="short").encode())
+        maskfile = self.config.maskfile
+        if maskfile and os.path.exists(maskfile):
+            stat = os.stat(maskfile)
+            h.update(("%d %d" % (stat.st_size, stat.st_mtime_ns)).encode())
+        rv = h.hexdigest()
+        return rv
+
+    def iterIntegrate(
+        self,
+        filelist,
+        filename=None,
+        flip=None,
+        correction=None,
+        extramask=None,
+        prefetch=None,
+    ):
+        """Integrate files separately and yield the result of each file
+        as soon as it is ready. The next images are loaded by a
+        background thread while the current one is integrated.
+
+        :param filelist: list of str (or 2d arrays), files to be
+            integrated (full path)
+        :param filename: file name of output files, if not None, an
+            index is appended to it for each file
+        :param flip: same as self.integrate
+        :param correction: same as self.integrate
+        :param extramask: 2d array, extra mask applied in integration
+        :param prefetch: int, number of images loaded ahead, if None,
+            use self.config.prefetch, 0 to load images in turn
+
+        :return: generator of dict, same as self.integrate, in the
+            order of filelist
+        """
+        prefetch = self.config.prefetch if prefetch is None else prefetch
+        images = self._prefetchImages(filelist, prefetch)
+        for i, (image, pic) in enumerate(images):
+            savename = None if filename is None else filename + "%03d" % i
+            yield self._integrateLoaded(
+                image, pic, savename, flip, correction, extramask
+            )
+        return
+
+    def _integrateLoaded(
+        self,
+        image,
+        pic,
+        savename=None,
+        flip=None,
+        correction=None,
+        extramask=None,
+        savefile=True,
+    ):
+        """Integrate an image loaded by self._loadImage, flip and
+        correction are applied as if image was passed to
+        self.integrate.
+
+        :param image: str or 2d array, item loaded by self._loadImage
+        :param pic: 2d array, loaded image, its buffer (see
+            self._getBuffer) is released afterwards
+        :return: dict, same as self.integrate
+        """
+        if isinstance(image, str):
+            # loaded (and flipped) as a file, correct it as a file
+            savename = image if savename is None else savename
+            flip = False
+            correction = correction is None or correction is True
+        try:
+            rv = self.integrate(
+                pic,
+                savename=savename,
+                savefile=savefile,
+                flip=flip,
+                correction=correction,
+                extramask=extramask,
+            )
+        finally:
+            self._releaseBuffer(pic)
+        return rv
+
+    async def integrate_async(
+        self,
+        image,
+        savename=None,
+        savefile=True,
+        flip=None,
+        correction=None,
+        extramask=None,
+        executor=None,
+    ):
+        """Integrate an image without blocking the event loop, same as
+        self.integrate otherwise.
+
+        Loading and integration run in executor. At most
+        self.config.concurrency images are loaded or integrated at the
+        same time, and integrations run one at a time since they share
+        the tables of this instance. Cancelling the call stops it before
+        the next step (load or integration), a step already running in
+        the executor is completed but its result is dropped.
+
+        :param executor: concurrent.futures.Executor, if None, use the
+            default executor of the event loop
+        :return: dict, same as self.integrate
+        """
+        loop = asyncio.get_running_loop()
+        async with self._asyncSemaphore():
+            load = loop.run_in_executor(executor, self._loadImage, image)
+            try:
+                # shielded, so that the loaded image is still available
+                # to be released if the call is cancelled
+                pic = await asyncio.shield(load)
+            except asyncio.CancelledError:
+                load.add_done_callback(self._releaseLoaded)
+                raise
+            try:
+                integration = loop.run_in_executor(
+                    executor,
+                    self._integrateLocked,
+                    image,
+                    pic,
+                    savename,
+                    flip,
+                    correction,
+                    extramask,
+                    savefile,
+                )
+            except BaseException:
+                self._releaseBuffer(pic)
+                raise
+            # the integration releases pic, even if the call is cancelled
+            rv = await integration
+        return rv
+
+    async def iter_integrate_async(
+        self,
+        filelist,
+        filename=None,
+        flip=None,
+        correction=None,
+        extramask=None,
+        executor=None,
+    ):
+        """Integrate files separately without blocking the event loop
+        and yield the results in the order of filelist, see
+        self.integrate_async and self.iterIntegrate.
+
+        Up to self.config.concurrency files are scheduled ahead of the
+        consumer, they are cancelled if the iteration stops early.
+
+        :return: async generator of dict, same as self.integrate
+        """
+        pending = collections.deque()
+        try:
+            for i, image in enumerate(filelist):
+                savename = None if filename is None else filename + "%03d" % i
+                task = asyncio.ensure_future(
+                    self.integrate_async(
+                        image,
+                        savename=savename,
                         flip=flip,
                         correction=correction,
                         extramask=extramask,
+                        executor=executor,
                     )
-                rv.append(rvv)
+                )
+                pending.append(task)
+                if len(pending) >= self.config.concurrency:
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+        return
+
+    def _asyncSemaphore(self):
+        """Get the semaphore limiting the concurrency of the async API
+        in the running event loop."""
+        key = (asyncio.get_running_loop(), max(self.config.concurrency, 1))
+        if self._asyncsemaphore is None or self._asyncsemaphore[0] != key:
+            self._asyncsemaphore = (key, asyncio.Semaphore(key[1]))
+        return self._asyncsemaphore[1]
+
+    def _releaseLoaded(self, future):
+        """Release the buffer of an image loaded by a future of
+        self._loadImage whose result is not used."""
+        if not future.cancelled() and future.exception() is None:
+            self._releaseBuffer(future.result())
+        return
+
+    def _integrateLocked(self, *args):
+        """self._integrateLoaded holding the integration lock, called
+        from executor threads."""
+        with self._integratelock:
+            rv = self._integrateLoaded(*args)
+        return rv
+
+    def _prefetchImages(self, filelist, prefetch):
+        """Load images in a background thread, at most prefetch images
+        ahead of the consumer, so that memory use stays bounded.
+
+        :param filelist: list of str (or 2d arrays), image files
+        :param prefetch: int, number of images loaded ahead, 0 to load
+            images in the calling thread
+        :return: generator of tuple, (item of filelist, 2d array), an
+            error raised when loading a file is raised at its position,
+            the consumer releases the buffer of each array (see
+            self._getBuffer)
+        """
+        if prefetch <= 0:
+            for image in filelist:
+                yield image, self._loadImage(image)
+            return
+        buffer = queue.Queue(prefetch)
+        stop = threading.Event()
+
+        def put(value):
+            # give up if the consumer is gone
+            while not stop.is_set():
+                try:
+                    buffer.put(value, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def load():
+            for image in filelist:
+                try:
+                    value = (image, self._loadImage(image), None)
+                except Exception as e:
+                    value = (image, None, e)
+                if not put(value):
+                    self._releaseBuffer(value[1])
+                    return
+                if value[2] is not None:
+                    return
+            put(None)
+            return
+
+        def drain():
+            # release the images loaded but not consumed
+            while True:
+                try:
+                    value = buffer.get_nowait()
+                except queue.Empty:
+                    return
+                if value is not None:
+                    self._releaseBuffer(value[1])
+
+        thread = threading.Thread(target=load, daemon=True)
+        thread.start()
+        try:
+            while True:
+                value = buffer.get()
+                if value is None:
+                    break
+                image, pic, error = value
+                if error is not None:
+                    raise error
+                yield image, pic
+        finally:
+            stop.set()
+            # the loading thread may wait for a buffer held in the queue
+            drain()
+            thread.join()
+            drain()
+        return
+
+    def _loadImage(self, image):
+        """Load an image file (into a buffer of self.bufferpool if it is
+        enabled), pass through 2d arrays."""
+        if not isinstance(image, str):
+            return image
+        buffer = self._getBuffer()
+        try:
+            rv = self.loadimage.load_image(image, out=buffer)
+        except BaseException:
+            # e.g. corrupt file, the buffer is not used
+            self._releaseBuffer(buffer)
+            raise
         return rv
 
+    def _getBuffer(self):
+        """Acquire a buffer of self.bufferpool to load an image into, see
+        the bufferpool option. It is released by self._releaseBuffer
+        once the image is integrated.
+
+        :return: 2d array, None if the buffer pool is disabled
+        """
+        if self.config.bufferpool <= 0:
+            return None
+        shape = (self.config.ydimension, self.config.xdimension)
+        dtype = self.calculate.dtype
+        size = max(
+            self.config.bufferpool,
+            self.config.prefetch + 2,
+            self.config.concurrency + 1,
+        )
+        pool = self.bufferpool
+        key = (shape, dtype, size)
+        if pool is None or (pool.shape, pool.dtype, pool.size) != key:
+            pool = self.bufferpool = BufferPool(*key)
+        rv = pool.acquire()
+        return rv
+
+    def _releaseBuffer(self, pic):
+        """Release the buffer of an image loaded by self._getPic or
+        self._loadImage, nothing is done if pic is not a buffer of
+        self.bufferpool.
+
+        :param pic: 2d array
+        :return: None
+        """
+        if self.bufferpool is not None:
+            self.bufferpool.release(pic)
+        return
+
+    def _iterParallel(self, filelist, filename, flip, correction, extramask):
+        """Integrate files separately in self.config.jobs workers and
+        yield the results in the order of filelist, see
+        self.integrateFilelist.
+
+        :return: generator of dict, same as self.integrate
+        """
+        kwargs = {
+            "flip": flip,
+            "correction": correction,
+            "extramask": extramask,
+        }
+        tasks = [
+            (imagefile, None if filename is None else filename + "%03d" % i)
+            for i, imagefile in enumerate(filelist)
+        ]
+        yield from self._mapWorkers(_integrateInWorker, tasks, kwargs)
+        return
+
+    def _mapWorkers(self, func, tasks, kwargs):
+        """Run func(task) for each task in self.config.jobs workers and
+        yield the results in the order of tasks.
+
+        Each worker has its own SrXplanar instance. Geometry matrices,
+        correction matrix and integration tables already computed here
+        are shared with the workers instead of being recomputed:
+        directly in threads, or through memory mapped files
+        (SharedArrays) in processes, where the BLAS/OpenMP threads are
+        also limited to 1 per worker.
+
+        :param func: module level function, called in workers
+        :param tasks: list, arguments of func
+        :param kwargs: dict, kwargs of SrXplanar.integrate, available
+            to func in the worker
+        :return: generator, results of func
+        """
+        arrays = self.calculate.exportGeometry()
+        jobs = max(min(self.config.jobs, len(tasks)), 1)
+        if self.config.executor == "thread":
+            initargs = (self.config, arrays, False, kwargs)
+            with ThreadPoolExecutor(
+                jobs, initializer=_initWorker, initargs=initargs
+            ) as pool:
+                yield from pool.map(func, tasks)
+        else:
+            with SharedArrays(arrays) as shared:
+                initargs = (self.config, shared.descriptors, True, kwargs)
+                with ProcessPoolExecutor(
+                    jobs, initializer=_initWorker, initargs=initargs
+                ) as pool:
+                    # workers are started when tasks are submitted
+                    with singleThreadEnv():
+                        results = pool.map(func, tasks)
+                    yield from results
+        return
+
     def process(self):
         """Process the images according to
         filenames/includepattern/excludepattern/summation by default, it
@@ -298,7 +1040,19 @@ class SrXplanar(object):
         """
         if not self.config.nocalculation:
             filelist = self.loadimage.genFileList()
-            if len(filelist) > 0:
+            if self.config.queuefile != "":
+                self.processQueue()
+            elif self.config.watch:
+
+                def report(rv):
+                    print("%s: %.3f s" % (rv["filename"], rv["latency"]))
+                    return
+
+                try:
+                    self.watch(callback=report)
+                except KeyboardInterrupt:
+                    pass
+            elif len(filelist) > 0:
                 self.prepareCalculation(pic=filelist[0])
                 self.integrateFilelist(filelist)
             else:
@@ -313,6 +1067,138 @@ class SrXplanar(object):
             self.config.args.print_help()
         return
 
+    def watch(
+        self,
+        interval=None,
+        timeout=None,
+        maxfiles=None,
+        callback=None,
+        errorcallback=None,
+    ):
+        """Watch self.config.opendirectory and integrate each image file
+        matching filenames/includepattern/excludepattern once, as soon
+        as it is completely written. The geometry is prepared once at
+        the start and kept for all files.
+
+        The directory is polled every interval seconds, a file is taken
+        as completely written when its size and modification time do not
+        change for one interval (or its modification time is older than
+        one interval). Files already in the directory are integrated
+        first. A file failing to integrate (e.g. corrupt) is reported
+        and marked as failed, it is tried again only if it changes.
+
+        :param interval: float, polling interval in seconds, if None,
+            use self.config.watchinterval
+        :param timeout: float, stop after timeout seconds, if None,
+            watch until interrupted
+        :param maxfiles: int, stop after maxfiles files are integrated,
+            if None, no limit
+        :param callback: callable, called with the result of each file
+            (see self.integrate), rv['latency'] is the time in seconds
+            from the last modification of the image file to its results
+            being saved
+        :param errorcallback: callable, called with the image file and
+            the exception of each file failing to integrate, if None,
+            print the error
+
+        :return: list of tuple, (image file, saved file, latency) of
+            each integrated file, in the order of integration
+        """
+        interval = self.config.watchinterval if interval is None else interval
+        self.prepareCalculation()
+        start = time.time()
+        done = set()
+        # (size, mtime) of files seen in the previous poll, and of files
+        # failed to integrate
+        pending = {}
+        failed = {}
+        rv = []
+        while True:
+            fileset = self.loadimage.genFileSet(fullpath=True) - done
+            for imagefile in sorted(fileset):
+                try:
+                    stat = os.stat(imagefile)
+                except OSError:
+                    # removed
+                    continue
+                state = (stat.st_size, stat.st_mtime_ns)
+                if failed.get(imagefile) == state:
+                    continue
+                age = time.time() - stat.st_mtime
+                if pending.get(imagefile) != state and age < interval:
+                    pending[imagefile] = state
+                    continue
+                pending.pop(imagefile, None)
+                try:
+                    result = self.integrate(imagefile)
+                except Exception as e:
+                    failed[imagefile] = state
+                    if errorcallback is not None:
+                        errorcallback(imagefile, e)
+                    else:
+                        print(
+                            "Failed to integrate %s: %s: %s"
+                            % (imagefile, type(e).__name__, e)
+                        )
+                    continue
+                failed.pop(imagefile, None)
+                done.add(imagefile)
+                result["latency"] = time.time() - stat.st_mtime
+                rv.append((imagefile, result["filename"], result["latency"]))
+                if callback is not None:
+                    callback(result)
+                if maxfiles is not None and len(rv) >= maxfiles:
+                    return rv
+            if timeout is not None and time.time() - start >= timeout:
+                return rv
+            time.sleep(interval)
+
+    def processQueue(
+        self, queuefile=None, filelist=None, worker=None, maxfiles=None
+    ):
+        """Add files to a work queue shared with other workers, then
+        claim and integrate pending files until none is left.
+
+        Files claimed more than self.config.queuestale seconds ago are
+        put back to pending first, so that the files of a crashed worker
+        are integrated again. Errors of a file are recorded in the queue
+        and do not stop the worker.
+
+        :param queuefile: str, SQLite database of the queue, if None,
+            use self.config.queuefile
+        :param filelist: list of str, files to add to the queue, if
+            None, add files in opendirectory matching
+            filenames/includepattern/excludepattern
+        :param worker: str, id of this worker, if None, use host:pid
+        :param maxfiles: int, stop after maxfiles files, if None, no
+            limit
+        :return: dict, number of files in each state of the queue
+        """
+        queuefile = self.config.queuefile if queuefile is None else queuefile
+        if filelist is None:
+            filelist = sorted(self.loadimage.genFileSet(fullpath=True))
+        workqueue = WorkQueue(queuefile)
+        try:
+            workqueue.addFiles(filelist)
+            workqueue.requeue(stale=self.config.queuestale)
+            self.prepareCalculation()
+            nfiles = 0
+            while maxfiles is None or nfiles < maxfiles:
+                imagefile = workqueue.claim(worker)
+                if imagefile is None:
+                    break
+                try:
+                    rv = self.integrate(imagefile)
+                except Exception as e:
+                    workqueue.fail(imagefile, "%s: %s" % (type(e).__name__, e))
+                else:
+                    workqueue.finish(imagefile, str(rv["filename"]))
+                nfiles += 1
+            rv = workqueue.counts()
+        finally:
+            workqueue.close()
+        return rv
+
     def createMask(self, filename=None, pic=None, addmask=None):
         """Create and save a mask according to addmask, pic, 1 stands
         for masked pixel in saved file.
@@ -353,6 +1239,57 @@ class SrXplanar(object):
         return rv
 
 
+# SrXplanar instance and integrate kwargs of each worker thread or process
+_worker = threading.local()
+
+
+def _initWorker(config, arrays, shared, kwargs):
+    """Init a worker of SrXplanar._mapWorkers.
+
+    :param config: SrXplanarConfig, config of the parent instance
+    :param arrays: dict, result of Calculate.exportGeometry, or
+        SharedArrays.descriptors of it if shared is True
+    :param shared: bool, True in a worker process
+    :param kwargs: dict, kwargs passed to SrXplanar.integrate
+    :return: None
+    """
+    if shared:
+        _worker.limiter = limitWorkerThreads()
+        arrays = attachArrays(arrays)
+        # an instance sets up the properties of degree options on the
+        # config class, they are missing in a spawned process
+        SrXplanarConfig()
+    srx = SrXplanar(srxplanarconfig=copy.deepcopy(config))
+    srx.calculate.importGeometry(arrays)
+    srx.prepareCalculation()
+    _worker.srx = srx
+    _worker.kwargs = kwargs
+    return
+
+
+def _accumulateInWorker(filelist):
+    """Accumulate files in a worker of SrXplanar._mapWorkers.
+
+    :param filelist: list of str, image files
+    :return: IntegrationAccumulator
+    """
+    rv = None
+    for imagefile in filelist:
+        rv = _worker.srx.accumulate(imagefile, rv, **_worker.kwargs)
+    return rv
+
+
+def _integrateInWorker(task):
+    """Integrate one file in a worker of SrXplanar._mapWorkers.
+
+    :param task: tuple, (image file, save name or None)
+    :return: dict, result of SrXplanar.integrate
+    """
+    imagefile, savename = task
+    rv = _worker.srx.integrate(imagefile, savename=savename, **_worker.kwargs)
+    return rv
+
+
 def main():
     """Read config and integrate images."""
     srxplanar = SrXplanar(args=sys.argv[1:])
@@ -8,7 +8,8 @@ def main():
         prog="diffpy.srxplanar",
         description=(
             "2D diffraction image integration using non "
-            "splitting pixel algorithm\n\nFor more information, visit: "
+            "splitting (or optional splitting) pixel algorithm"
+            "\n\nFor more information, visit: "
             "https://github.com/diffpy/diffpy.srxplanar/"
         ),
         formatter_class=argparse.RawDescriptionHelpFormatter,
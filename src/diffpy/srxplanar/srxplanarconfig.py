@@ -78,6 +78,36 @@ _optdatalist = [
             "d": False,
         },
     ],
+    [
+        "watch",
+        {
+            "sec": "Control",
+            "config": "n",
+            "header": "n",
+            "h": (
+                "keep watching opendirectory and integrate new image"
+                " files once they are written"
+            ),
+            "n": "?",
+            "co": True,
+            "d": False,
+        },
+    ],
+    [
+        "incremental",
+        {
+            "sec": "Control",
+            "header": "n",
+            "h": (
+                "only integrate files that are new or changed, or were"
+                " integrated with a different config, according to the"
+                " manifest in savedirectory"
+            ),
+            "n": "?",
+            "co": True,
+            "d": False,
+        },
+    ],
     # Experiment group
     [
         "opendirectory",
@@ -207,6 +237,14 @@ _optdatalist = [
             "d": 0.02,
         },
     ],
+    [
+        "azimuthstepd",
+        {
+            "sec": "Experiment",
+            "h": "integration step in azimuthal angle (2D caking), in degree",
+            "d": 1.0,
+        },
+    ],
     # Beamline group
     [
         "includepattern",
@@ -418,6 +456,323 @@ so change this value does not require a config update,"
             "d": [1, 1, 1, 1],
         },
     ],
+    [
+        "integrationmethod",
+        {
+            "sec": "Others",
+            "h": (
+                "integration engine, 'lut' bins pixels with a pixel-to-bin"
+                " lookup table generated once per geometry and mask,"
+                " 'histogram' calls np.histogram on every image,"
+                " 'splitpixel' splits each pixel into bins according to"
+                " the tth or q range of its corners"
+            ),
+            "c": ["lut", "histogram", "splitpixel"],
+            "d": "lut",
+        },
+    ],
+    [
+        "precision",
+        {
+            "sec": "Others",
+            "h": (
+                "floating point precision of geometry, correction and"
+                " image arrays, 'float32' halves the memory traffic,"
+                " sums in each bin are always accumulated in float64"
+            ),
+            "c": ["float64", "float32"],
+            "d": "float64",
+        },
+    ],
+    [
+        "nthreads",
+        {
+            "sec": "Others",
+            "header": "f",
+            "h": (
+                "number of threads used to integrate one image, the image"
+                " is split into row blocks processed in parallel"
+            ),
+            "d": 1,
+        },
+    ],
+    [
+        "jobs",
+        {
+            "sec": "Others",
+            "header": "f",
+            "s": "j",
+            "h": (
+                "number of workers integrating a list of files in"
+                " parallel, each worker integrates whole images"
+            ),
+            "d": 1,
+        },
+    ],
+    [
+        "executor",
+        {
+            "sec": "Others",
+            "header": "f",
+            "h": (
+                "pool of workers used when jobs > 1, 'process' runs"
+                " workers in separate processes, 'thread' runs them in"
+                " threads of this process"
+            ),
+            "c": ["process", "thread"],
+            "d": "process",
+        },
+    ],
+    [
+        "prefetch",
+        {
+            "sec": "Others",
+            "header": "f",
+            "h": (
+                "number of images loaded ahead by a background thread"
+                " while the current image is integrated, 0 to load"
+                " images in turn, also the number of threads decoding"
+                " the files averaged in summation (at least 1)"
+            ),
+            "d": 2,
+        },
+    ],
+    [
+        "bufferpool",
+        {
+            "sec": "Others",
+            "header": "f",
+            "h": (
+                "number of reused buffers images are loaded into (at"
+                " least prefetch + 2 and concurrency + 1), so that no"
+                " new image array is allocated per image, a buffer is"
+                " reused once its image is integrated (so the pic"
+                " attribute is only valid until the next image is"
+                " loaded), 0 to allocate a new array for each image"
+            ),
+            "d": 0,
+        },
+    ],
+    [
+        "concurrency",
+        {
+            "sec": "Others",
+            "header": "f",
+            "h": (
+                "maximum number of images loaded or integrated at the"
+                " same time by the async API"
+            ),
+            "d": 2,
+        },
+    ],
+    [
+        "watchinterval",
+        {
+            "sec": "Others",
+            "header": "f",
+            "h": (
+                "polling interval in seconds of the watch mode, a new"
+                " file is integrated when its size and modification time"
+                " are unchanged for one interval"
+            ),
+            "d": 1.0,
+        },
+    ],
+    [
+        "readtimeout",
+        {
+            "sec": "Others",
+            "header": "f",
+            "h": (
+                "maximum time in seconds to wait for an image file to be"
+                " completely written and readable"
+            ),
+            "d": 5.0,
+        },
+    ],
+    [
+        "readstable",
+        {
+            "sec": "Others",
+            "header": "f",
+            "h": (
+                "an image file is read only when its size and"
+                " modification time have not changed for this time in"
+                " seconds, 0 to only check the size expected from the"
+                " file header"
+            ),
+            "d": 0.0,
+        },
+    ],
+    [
+        "queuefile",
+        {
+            "sec": "Others",
+            "header": "f",
+            "h": (
+                "SQLite database of a work queue shared by workers,"
+                " files are added to the queue and claimed one by one"
+                " (several workers, also on other hosts, can share the"
+                " same queue), empty to integrate files directly"
+            ),
+            "d": "",
+            "tt": "file",
+        },
+    ],
+    [
+        "queuestale",
+        {
+            "sec": "Others",
+            "header": "f",
+            "h": (
+                "files claimed by a worker for more than this time in"
+                " seconds are taken as abandoned (crashed worker) and"
+                " claimed again"
+            ),
+            "d": 600.0,
+        },
+    ],
+    [
+        "manifesthash",
+        {
+            "sec": "Others",
+            "header": "f",
+            "h": (
+                "in incremental mode, also compare the content hash of"
+                " files, not only their size and modification time"
+            ),
+            "d": False,
+        },
+    ],
+    [
+        "cachedirectory",
+        {
+            "sec": "Others",
+            "header": "f",
+            "h": (
+                "directory of the on-disk cache of geometry matrices and"
+                " integration tables, empty to disable the cache"
+            ),
+            "d": "",
+            "tt": "directory",
+        },
+    ],
+    [
+        "cachesize",
+        {
+            "sec": "Others",
+            "header": "f",
+            "h": (
+                "max size of the on-disk cache, in MB, least recently"
+                " used entries are removed when it is exceeded"
+            ),
+            "d": 2048.0,
+        },
+    ],
+    [
+        "integrationstatistic",
+        {
+            "sec": "Others",
+            "h": (
+                "statistic of pixels in each bin, 'mean' is the plain"
+                " average, 'sigmaclip' iteratively rejects pixels outside"
+                " sigmaclipk * std of their bin, 'median', 'percentile'"
+                " and 'trimmedmean' are order statistics of pixels in"
+                " each bin (robust statistics replace avgmask)"
+            ),
+            "c": ["mean", "sigmaclip", "median", "percentile", "trimmedmean"],
+            "d": "mean",
+        },
+    ],
+    [
+        "sigmaclipk",
+        {
+            "sec": "Others",
+            "h": (
+                "pixels deviating from the mean of their bin by more than"
+                " sigmaclipk * std are rejected in 'sigmaclip' statistic"
+            ),
+            "d": 3.0,
+        },
+    ],
+    [
+        "sigmaclipiterations",
+        {
+            "sec": "Others",
+            "h": "max number of iterations of 'sigmaclip' statistic",
+            "d": 3,
+        },
+    ],
+    [
+        "percentile",
+        {
+            "sec": "Others",
+            "h": "percentile (0-100) of 'percentile' statistic",
+            "d": 50.0,
+        },
+    ],
+    [
+        "trimfraction",
+        {
+            "sec": "Others",
+            "h": (
+                "fraction of pixels trimmed from each end of a bin in"
+                " 'trimmedmean' statistic, should be less than 0.5"
+            ),
+            "d": 0.1,
+        },
+    ],
+    [
+        "uncertaintymode",
+        {
+            "sec": "Others",
+            "h": (
+                "estimator of pixel variance used in uncertainty"
+                " propagation, 'local' uses the local variance of the full"
+                " image (reference), 'fast' uses the local variance of a"
+                " strided pixel subsample, 'poisson' uses counts *"
+                " detectorgain (photon counting detectors)"
+            ),
+            "c": ["local", "fast", "poisson"],
+            "d": "local",
+        },
+    ],
+    [
+        "gainstride",
+        {
+            "sec": "Others",
+            "h": (
+                "stride of the pixel subsample used by the 'fast'"
+                " uncertainty mode"
+            ),
+            "d": 4,
+        },
+    ],
+    [
+        "detectorgain",
+        {
+            "sec": "Others",
+            "h": (
+                "variance of raw counts divided by raw counts, used by the"
+                " 'poisson' uncertainty mode"
+            ),
+            "d": 1.0,
+        },
+    ],
+    [
+        "gainreuse",
+        {
+            "sec": "Others",
+            "h": (
+                "reuse the gain (variance/counts) estimated from the first"
+                " image for the following images, only valid if the"
+                " exposure conditions are unchanged"
+            ),
+            "n": "?",
+            "co": True,
+            "d": False,
+        },
+    ],
     [
         "nocalculation",
         {
@@ -524,10 +879,11 @@ class SrXplanarConfig(ConfigBase):
         this method will be called before reading config from
         file/args/kwargs
 
-        add degree/rad delegation for rotation, tilt, tthstep, tthmax
+        add degree/rad delegation for rotation, tilt, tthstep, tthmax,
+        azimuthstep
         """
 
-        for name in ["rotation", "tilt", "tthstep", "tthmax"]:
+        for name in ["rotation", "tilt", "tthstep", "tthmax", "azimuthstep"]:
             setattr(self.__class__, name, _configPropertyRad(name + "d"))
         # cls._configlist['Experiment'].extend([
         #     'rotation',
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# diffpy.srxplanar  by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2010-2025 Trustees of the Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# File coded by:    Xiaohao Yang
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE.txt for license information.
+#
+##############################################################################
+"""SQLite work queue of image files shared by integration workers."""
+
+import os
+import socket
+import sqlite3
+import time
+
+_schema = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    added REAL,
+    started REAL,
+    finished REAL,
+    output TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS files_state ON files (state);
+"""
+
+# states of files in the queue
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def defaultWorkerId():
+    """Get an id of this worker process, host:pid.
+
+    :return: str
+    """
+    rv = "%s:%d" % (socket.gethostname(), os.getpid())
+    return rv
+
+
+class WorkQueue(object):
+    """Queue of image files stored in a SQLite database, so that any
+    number of worker processes can share it.
+
+    Each file is pending, running (claimed by a worker), done or failed,
+    with the id of the worker and timings of its last attempt. Files are
+    claimed atomically in a write transaction, so each pending file is
+    given to one worker only. The database can be put on a shared
+    filesystem to spread the work over several hosts, as long as the
+    filesystem supports file locking.
+    """
+
+    def __init__(self, filename, timeout=60.0):
+        """
+        :param filename: str, path of the database file, created if it
+            does not exist
+        :param timeout: float, time in seconds to wait for the lock of
+            the database held by other workers
+        """
+        self.filename = filename
+        # autocommit, transactions are opened explicitly
+        self.connection = sqlite3.connect(
+            filename, timeout=timeout, isolation_level=None
+        )
+        self.connection.executescript(_schema)
+        return
+
+    def close(self):
+        self.connection.close()
+        return
+
+    def addFiles(self, filelist):
+        """Add files to the queue as pending, files already in the queue
+        are kept in their current state.
+
+        :param filelist: list of str, paths of image files
+        :return: int, number of files added
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            cursor = self.connection.executemany(
+                "INSERT OR IGNORE INTO files (path, added) VALUES (?, ?)",
+                [(path, now) for path in filelist],
+            )
+        rv = cursor.rowcount
+        return rv
+
+    def claim(self, worker=None):
+        """Claim the next pending file.
+
+        :param worker: str, id of the worker, if None, use host:pid
+        :return: str, path of the claimed file, None if there is no
+            pending file
+        """
+        worker = defaultWorkerId() if worker is None else worker
+        with self.connection:
+            # take the write lock before reading, so that two workers
+            # never claim the same file
+            self.connection.execute("BEGIN IMMEDIATE")
+            row = self.connection.execute(
+                "SELECT path FROM files WHERE state = ? ORDER BY path LIMIT 1",
+                (PENDING,),
+            ).fetchone()
+            if row is not None:
+                self.connection.execute(
+                    "UPDATE files SET state = ?, worker = ?, started = ?,"
+                    " finished = NULL, attempts = attempts + 1"
+                    " WHERE path = ?",
+                    (RUNNING, worker, time.time(), row[0]),
+                )
+        rv = None if row is None else row[0]
+        return rv
+
+    def finish(self, path, output=None):
+        """Mark a claimed file as done.
+
+        :param path: str, path of the file
+        :param output: str, path of the saved results
+        :return: None
+        """
+        self._setState(path, DONE, output=output, error=None)
+        return
+
+    def fail(self, path, error):
+        """Mark a claimed file as failed.
+
+        :param path: str, path of the file
+        :param error: str, error message
+        :return: None
+        """
+        self._setState(path, FAILED, error=error)
+        return
+
+    def _setState(self, path, state, **kwargs):
+        columns = ", ".join("%s = ?" % k for k in kwargs)
+        with self.connection:
+            self.connection.execute(
+                "UPDATE files SET state = ?, finished = ?, %s WHERE path = ?"
+                % columns,
+                [state, time.time()] + list(kwargs.values()) + [path],
+            )
+        return
+
+    def requeue(self, stale=None, failed=False, maxattempts=None):
+        """Put files back to pending.
+
+        :param stale: float, requeue running files claimed more than
+            stale seconds ago (their worker likely died), None to keep
+            them running
+        :param failed: bool, requeue failed files
+        :param maxattempts: int, only requeue files tried less than
+            maxattempts times, None for no limit
+        :return: int, number of requeued files
+        """
+        conditions = []
+        params = []
+        if stale is not None:
+            conditions.append("(state = ? AND started < ?)")
+            params += [RUNNING, time.time() - stale]
+        if failed:
+            conditions.append("state = ?")
+            params.append(FAILED)
+        if not conditions:
+            return 0
+        query = "UPDATE files SET state = ?, worker = NULL WHERE (%s)" % (
+            " OR ".join(conditions)
+        )
+        params = [PENDING] + params
+        if maxattempts is not None:
+            query += " AND attempts < ?"
+            params.append(maxattempts)
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            cursor = self.connection.execute(query, params)
+        rv = cursor.rowcount
+        return rv
+
+    def counts(self):
+        """Count files in each state.
+
+        :return: dict, state -> number of files
+        """
+        rv = {state: 0 for state in [PENDING, RUNNING, DONE, FAILED]}
+        rows = self.connection.execute(
+            "SELECT state, COUNT(*) FROM files GROUP BY state"
+        )
+        rv.update(dict(rows))
+        return rv
+
+    def files(self, state=None):
+        """List files in the queue with their state and timings.
+
+        :param state: str, only list files in this state, None for all
+        :return: list of dict, with keys path, state, worker, attempts,
+            added, started, finished, output and error
+        """
+        query = "SELECT * FROM files"
+        params = []
+        if state is not None:
+            query += " WHERE state = ?"
+            params.append(state)
+        cursor = self.connection.execute(query + " ORDER BY path", params)
+        names = [d[0] for d in cursor.description]
+        rv = [dict(zip(names, row)) for row in cursor]
+        return rv
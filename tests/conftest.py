@@ -1,8 +1,12 @@
 import json
 from pathlib import Path
 
+import numpy as np
 import pytest
 
+from diffpy.srxplanar.srxplanar import SrXplanar
+from diffpy.srxplanar.srxplanarconfig import SrXplanarConfig
+
 
 @pytest.fixture
 def user_filesystem(tmp_path):
@@ -26,3 +30,61 @@ def user_filesystem(tmp_path):
         "home": home_dir,
         "test": test_dir,
     }
+
+
+@pytest.fixture
+def geometry():
+    # small tilted detector to keep the tests fast
+    return {
+        "xdimension": 128,
+        "ydimension": 96,
+        "xbeamcenter": 60.3,
+        "ybeamcenter": 50.7,
+        "xpixelsize": 0.4,
+        "ypixelsize": 0.4,
+        "distance": 60.0,
+        "tiltd": 2.0,
+        "rotationd": 30.0,
+        "tthstepd": 0.2,
+    }
+
+
+@pytest.fixture
+def make_config(geometry):
+    def make(**kwargs):
+        return SrXplanarConfig(**dict(geometry, **kwargs))
+
+    return make
+
+
+@pytest.fixture
+def srx_options(geometry, tmp_path):
+    # no dynamic masks, so that results only depend on the geometry
+    return dict(
+        geometry,
+        brightpixelmask=False,
+        darkpixelmask=False,
+        avgmask=False,
+        savedirectory=str(tmp_path),
+    )
+
+
+@pytest.fixture
+def srx(srx_options):
+    srx = SrXplanar(**srx_options)
+    srx.prepareCalculation()
+    return srx
+
+
+@pytest.fixture
+def save_frames(tmp_path):
+    # save images as frame<i>.npy files, return the list of their paths
+    def save(stack, directory=None, dtype=None):
+        directory = tmp_path if directory is None else directory
+        rv = []
+        for i, image in enumerate(stack):
+            rv.append(str(directory / ("frame%d.npy" % i)))
+            np.save(rv[-1], image if dtype is None else image.astype(dtype))
+        return rv
+
+    return save
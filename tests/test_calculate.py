@@ -0,0 +1,224 @@
+import threading
+
+import numpy as np
+import pytest
+from scipy.stats import trim_mean
+
+from diffpy.srxplanar.calculate import Calculate
+
+
+def make_image(config, seed=0):
+    rng = np.random.default_rng(seed)
+    shape = (config.ydimension, config.xdimension)
+    return rng.poisson(100, shape).astype(float)
+
+
+@pytest.mark.parametrize("integrationspace", ["twotheta", "qspace"])
+def test_lut_matches_histogram(make_config, integrationspace):
+    config = make_config(integrationspace=integrationspace)
+    image = make_image(config)
+    mask = np.zeros(image.shape, dtype=bool)
+    mask[40:50, 20:90] = True
+
+    rv = {}
+    for method in ["histogram", "lut"]:
+        config.updateConfig(integrationmethod=method)
+        calculate = Calculate(config)
+        calculate.genIntegrationInds(mask)
+        rv[method] = (calculate.intensity(image), calculate.bin_number)
+
+    assert np.allclose(rv["lut"][0], rv["histogram"][0])
+    assert np.array_equal(rv["lut"][1], rv["histogram"][1])
+
+
+def test_bin_number_follows_mask(make_config):
+    config = make_config()
+    calculate = Calculate(config)
+    calculate.genIntegrationInds()
+    nopixels = calculate.bin_number.sum()
+
+    mask = np.zeros((config.ydimension, config.xdimension), dtype=bool)
+    mask[30:40, 30:40] = True
+    calculate.genIntegrationInds(mask)
+    assert calculate.bin_number.sum() == nopixels - 100
+
+
+@pytest.mark.parametrize("integrationspace", ["twotheta", "qspace"])
+def test_splitpixel(make_config, integrationspace):
+    config = make_config(
+        integrationspace=integrationspace, integrationmethod="splitpixel"
+    )
+    calculate = Calculate(config)
+    mask = np.zeros((config.ydimension, config.xdimension), dtype=bool)
+    mask[40:50, 20:90] = True
+    calculate.genIntegrationInds(mask)
+
+    # each unmasked pixel is split into bins with weights summing to 1
+    weights = np.asarray(calculate.bin_matrix.sum(axis=0)).ravel()
+    unmasked = np.logical_not(calculate.integrationmask).ravel()
+    assert np.allclose(weights[unmasked], 1)
+    assert np.allclose(weights[~unmasked], 0)
+
+    # a flat image gives a flat pattern without aliasing
+    image = np.full((config.ydimension, config.xdimension), 10.0)
+    intensity = calculate.intensity(image)[1]
+    covered = calculate.bin_number > 1
+    assert np.allclose(intensity[covered], 10.0)
+
+    # same total intensity as the non splitting lookup table
+    image = make_image(config)
+    total = (calculate.intensity(image)[1] * calculate.bin_number).sum()
+    config.updateConfig(integrationmethod="lut")
+    lut = Calculate(config)
+    lut.genIntegrationInds(mask)
+    lutotal = (lut.intensity(image)[1] * lut.bin_number).sum()
+    assert np.isclose(total, lutotal)
+
+
+def test_lazy_geometry(make_config):
+    config = make_config(integrationspace="qspace")
+    calculate = Calculate(config)
+    calculate.genIntegrationInds()
+    dmatrix = calculate.dmatrix
+    radialmatrix = calculate.radialmatrix
+    image = make_image(config)
+
+    # wavelength only rescales the bin edges
+    config.updateConfig(wavelength=0.2)
+    calculate.prepareCalculation()
+    calculate.genIntegrationInds()
+    assert calculate.dmatrix is dmatrix
+    assert calculate.radialmatrix is radialmatrix
+    assert calculate.tthorqmatrix.max() > 0
+
+    expected = Calculate(
+        make_config(integrationspace="qspace", wavelength=0.2)
+    )
+    expected.genIntegrationInds()
+    assert np.array_equal(calculate.bin_number, expected.bin_number)
+    assert np.allclose(calculate.intensity(image), expected.intensity(image))
+
+    # beam center invalidates the geometry
+    config.updateConfig(xbeamcenter=61.0)
+    assert calculate.dmatrix is not dmatrix
+    assert calculate.radialmatrix is not radialmatrix
+
+
+def test_uncertaintymode(make_config):
+    config = make_config()
+    calculate = Calculate(config)
+    calculate.genIntegrationInds()
+    image = make_image(config) * 3.0
+    local = calculate.intensity(image)
+
+    config.updateConfig(uncertaintymode="fast")
+    fast = calculate.intensity(image)
+    assert np.array_equal(fast[1], local[1])
+    assert np.allclose(fast[2], local[2], rtol=0.05)
+
+    # the gain of the first image is reused until it is reset
+    config.updateConfig(gainreuse=True)
+    calculate.intensity(image)
+    reused = calculate.intensity(image * 2.0)
+    assert np.allclose(reused[2], np.sqrt(2.0) * fast[2])
+    calculate.resetGain()
+    assert np.allclose(calculate.intensity(image * 2.0)[2], 2.0 * fast[2])
+
+
+def test_sigmaclip(make_config):
+    config = make_config()
+    calculate = Calculate(config)
+    calculate.genIntegrationInds()
+    image = make_image(config)
+    clean = calculate.intensity(image)
+
+    # a few hot pixels bias the mean, but are rejected by sigma clipping
+    hot = image.copy()
+    hot[20:70:7, 20:100:9] = 1e5
+    assert not np.allclose(calculate.intensity(hot)[1], clean[1], rtol=0.1)
+    config.updateConfig(integrationstatistic="sigmaclip")
+    clipped = calculate.intensity(hot)
+    covered = calculate.bin_number > 1
+    assert np.allclose(clipped[1][covered], clean[1][covered], rtol=0.1)
+
+    # same result in stack integration
+    stack = calculate.intensityStack(hot[np.newaxis])
+    assert np.allclose(stack[0], clipped)
+
+    # nothing is rejected with a large k
+    config.updateConfig(sigmaclipk=100.0)
+    assert np.allclose(calculate.intensity(image), clean)
+
+
+@pytest.mark.parametrize(
+    "noise",
+    [0.0, 1e-5],
+)
+def test_sigmaclip_low_noise(make_config, noise):
+    # flat image, and an image with noise far below its mean
+    config = make_config()
+    calculate = Calculate(config)
+    calculate.genIntegrationInds()
+    shape = (config.ydimension, config.xdimension)
+    base = 3.3 if noise == 0 else 1e4
+    image = base + np.random.default_rng(0).normal(0, noise, shape)
+    expected = calculate.intensity(image)[1]
+    config.updateConfig(integrationstatistic="sigmaclip")
+    intensity = calculate.intensity(image)[1]
+    covered = calculate.bin_number > 1
+    assert np.allclose(intensity[covered], expected[covered])
+    assert np.all(calculate.statcount[covered] > 0)
+
+
+@pytest.mark.parametrize(
+    "statistic, reference",
+    [
+        ("median", np.median),
+        ("percentile", lambda a: np.percentile(a, 90)),
+        ("trimmedmean", lambda a: trim_mean(a, 0.1)),
+    ],
+)
+def test_order_statistics(make_config, statistic, reference):
+    config = make_config(
+        integrationstatistic=statistic, percentile=90.0, trimfraction=0.1
+    )
+    calculate = Calculate(config)
+    mask = np.zeros((config.ydimension, config.xdimension), dtype=bool)
+    mask[40:50, 20:90] = True
+    calculate.genIntegrationInds(mask)
+    image = make_image(config)
+    intensity = calculate.intensity(image)[1]
+
+    pixels = calculate.getMaskedmatrixPic(image)[1].ravel()
+    for b in range(len(intensity)):
+        values = pixels[calculate.bin_inds == b]
+        expected = reference(values) if len(values) else 0
+        assert np.isclose(intensity[b], expected)
+
+
+@pytest.mark.parametrize(
+    "statistic, option",
+    [
+        ("trimmedmean", {"trimfraction": 0.5}),
+        ("trimmedmean", {"trimfraction": -0.1}),
+        ("percentile", {"percentile": 101.0}),
+        ("percentile", {"percentile": -1.0}),
+    ],
+)
+def test_order_statistics_invalid(make_config, statistic, option):
+    config = make_config(integrationstatistic=statistic, **option)
+    calculate = Calculate(config)
+    calculate.genIntegrationInds()
+    with pytest.raises(ValueError, match=list(option)[0]):
+        calculate.intensity(make_image(config))
+
+
+def test_runBlocks_shared_pool(make_config):
+    nthreads = threading.active_count()
+    # instances kept alive, e.g. by the integration server
+    instances = [Calculate(make_config(nthreads=3)) for i in range(5)]
+    for calculate in instances:
+        rv = calculate.runBlocks(lambda r0, r1: (r0, r1), 10)
+        assert rv == [(0, 3), (3, 6), (6, 10)]
+    # the instances share the threads of one pool
+    assert threading.active_count() <= nthreads + 3
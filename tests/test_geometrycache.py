@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+import pytest
+
+from diffpy.srxplanar.srxplanar import SrXplanar
+
+
+@pytest.fixture
+def make_srx(srx_options, tmp_path):
+    def make(**kwargs):
+        options = dict(
+            srx_options,
+            savedirectory=str(tmp_path / "save"),
+            cachedirectory=str(tmp_path / "cache"),
+        )
+        options.update(kwargs)
+        srx = SrXplanar(**options)
+        srx.prepareCalculation()
+        return srx
+
+    return make
+
+
+@pytest.mark.parametrize("integrationmethod", ["lut", "splitpixel"])
+def test_cache_hit(make_srx, tmp_path, integrationmethod):
+    image = np.random.default_rng(0).poisson(100, (96, 128)).astype(float)
+    srx = make_srx(integrationmethod=integrationmethod)
+    kwargs = {"savefile": False, "correction": True}
+    expected = srx.integrate(image.copy(), **kwargs)["chi"]
+    entries = sorted(os.listdir(tmp_path / "cache"))
+    assert entries == sorted(srx.calculate.cache.active.values())
+
+    srx = make_srx(integrationmethod=integrationmethod)
+    assert isinstance(srx.calculate.tthmatrix, np.memmap)
+    assert isinstance(srx.correction, np.memmap)
+    actual = srx.integrate(image.copy(), **kwargs)["chi"]
+    assert np.array_equal(actual, expected)
+    assert sorted(os.listdir(tmp_path / "cache")) == entries
+
+
+def test_cache_key_and_eviction(make_srx, tmp_path):
+    srx = make_srx()
+    keys0 = set(srx.calculate.cache.active.values())
+    srx.updateConfig(xbeamcenter=61.0)
+    srx.prepareCalculation()
+    keys1 = set(srx.calculate.cache.active.values())
+    assert keys0.isdisjoint(keys1)
+    assert set(os.listdir(tmp_path / "cache")) == keys0 | keys1
+
+    # the active entries are kept even if they are larger than the cache
+    srx.updateConfig(cachesize=0.0, xbeamcenter=62.0)
+    srx.prepareCalculation()
+    entries = set(os.listdir(tmp_path / "cache"))
+    assert entries == set(srx.calculate.cache.active.values())
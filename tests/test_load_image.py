@@ -1,11 +1,14 @@
 import os
 import shutil
+import threading
+import time
 from pathlib import Path
 from types import SimpleNamespace
 
+import numpy as np
 import pytest
 
-from diffpy.srxplanar.loadimage import LoadImage
+from diffpy.srxplanar.loadimage import BufferPool, LoadImage
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 
@@ -64,3 +67,56 @@ def test_load_image(inputs, expected, user_filesystem):
             match=r"file not found:"
             r" .*Please rerun specifying a valid filename\.",
         )
+
+
+def test_load_partially_written(tmp_path):
+    image = np.arange(96 * 128, dtype=np.float64).reshape(96, 128)
+    filename = tmp_path / "frame.npy"
+    np.save(filename, image)
+    data = filename.read_bytes()
+    filename.write_bytes(data[: len(data) // 2])
+    config = SimpleNamespace(
+        fliphorizontal=False, flipvertical=False, readtimeout=5.0
+    )
+    loader = LoadImage(config)
+    assert not loader.isReady(filename)
+
+    def finish():
+        time.sleep(0.2)
+        with open(filename, "ab") as f:
+            f.write(data[len(data) // 2 :])
+
+    writer = threading.Thread(target=finish)
+    writer.start()
+    assert np.array_equal(loader.load_image(filename), image)
+    writer.join()
+
+    # an incomplete file is read anyway after the timeout
+    filename.write_bytes(data[: len(data) // 2])
+    config.readtimeout = 0.1
+    with pytest.raises(ValueError):
+        loader.load_image(filename)
+
+
+def test_load_image_out(tmp_path):
+    rng = np.random.default_rng(0)
+    image = rng.integers(-5, 100, (96, 128)).astype(np.int32)
+    filename = tmp_path / "frame.npy"
+    np.save(filename, image)
+    config = SimpleNamespace(fliphorizontal=True, flipvertical=True)
+    loader = LoadImage(config)
+    expected = loader.load_image(filename)
+
+    pool = BufferPool((96, 128), np.float32, size=2)
+    out = pool.acquire()
+    assert loader.load_image(filename, out=out) is out
+    assert np.array_equal(out, expected)
+    # a buffer is only reused once it is released
+    other = pool.acquire()
+    assert other is not out
+    pool.release(out)
+    pool.release(out)
+    assert pool.acquire() is out
+    assert pool.free.empty()
+    pool.release(other)
+    assert pool.acquire() is other
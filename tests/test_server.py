@@ -0,0 +1,123 @@
+import base64
+import copy
+import threading
+
+import numpy as np
+import pytest
+
+from diffpy.srxplanar.client import requestIntegration
+from diffpy.srxplanar.server import IntegrationServer, createServer
+from diffpy.srxplanar.srxplanar import SrXplanar
+from diffpy.srxplanar.srxplanarconfig import SrXplanarConfig
+
+
+@pytest.fixture
+def config(srx_options):
+    return SrXplanarConfig(**srx_options)
+
+
+def test_server(config, tmp_path):
+    server = createServer(IntegrationServer(config), port=0)
+    url = "http://127.0.0.1:%d" % server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        image = np.random.default_rng(0).poisson(100, (96, 128)) * 1.0
+        filename = str(tmp_path / "frame.npy")
+        np.save(filename, image)
+        array = {
+            "data": base64.b64encode(image.tobytes()).decode(),
+            "dtype": str(image.dtype),
+            "shape": image.shape,
+        }
+        for overlay in [{}, {"tthstepd": 0.5}]:
+            srx = SrXplanar(copy.deepcopy(config), **overlay)
+            srx.prepareCalculation()
+            expected = srx.integrate(filename, savefile=False)["chi"]
+            rv = requestIntegration(
+                {"image": filename, "config": overlay}, url
+            )
+            assert np.allclose(rv["chi"], expected)
+            assert rv["filename"].startswith(str(tmp_path))
+            rv = requestIntegration(
+                {"array": array, "config": overlay, "savefile": False}, url
+            )
+            expected = srx.integrate(image, savefile=False)["chi"]
+            assert np.allclose(rv["chi"], expected)
+        assert len(server.integrationserver.instances) == 2
+
+        with pytest.raises(RuntimeError, match="unknown options"):
+            requestIntegration({"image": filename, "config": {"x": 1}}, url)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_getInstance_concurrent(config, monkeypatch):
+    integrationserver = IntegrationServer(config)
+    integrationserver.getInstance()
+    prepare = SrXplanar.prepareCalculation
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slowprepare(self):
+        calls.append(self)
+        started.set()
+        if not release.wait(5):
+            calls.append("timeout")
+        return prepare(self)
+
+    monkeypatch.setattr(SrXplanar, "prepareCalculation", slowprepare)
+    results = []
+
+    def get():
+        results.append(integrationserver.getInstance({"tthstepd": 0.5}))
+
+    threads = [threading.Thread(target=get) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    assert started.wait(5)
+    # other instances are served while one is being prepared
+    monkeypatch.setattr(SrXplanar, "prepareCalculation", prepare)
+    assert integrationserver.getInstance() is not None
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert len(results) == 3
+    assert all(rv is results[0] for rv in results)
+
+
+def test_server_error(config, monkeypatch):
+    integrationserver = IntegrationServer(config)
+    server = createServer(integrationserver, port=0)
+    url = "http://127.0.0.1:%d" % server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    prepare = SrXplanar.prepareCalculation
+
+    def failingprepare(self):
+        raise RuntimeError("prepare failed")
+
+    try:
+        image = np.zeros((96, 128))
+        array = {
+            "data": base64.b64encode(image.tobytes()).decode(),
+            "dtype": str(image.dtype),
+            "shape": image.shape,
+        }
+        request = {"array": array, "savefile": False}
+        monkeypatch.setattr(SrXplanar, "prepareCalculation", failingprepare)
+        with pytest.raises(RuntimeError, match="prepare failed"):
+            requestIntegration(request, url)
+        assert len(integrationserver.instances) == 0
+
+        # the failed instance is prepared again by the next request
+        monkeypatch.setattr(SrXplanar, "prepareCalculation", prepare)
+        rv = requestIntegration(request, url)
+        assert len(rv["chi"]) >= 2
+        assert len(integrationserver.instances) == 1
+    finally:
+        server.shutdown()
+        server.server_close()
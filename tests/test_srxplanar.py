@@ -0,0 +1,469 @@
+import asyncio
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from diffpy.srxplanar.accumulator import IntegrationAccumulator
+
+
+def make_stack(srx, nframes=5, seed=0):
+    rng = np.random.default_rng(seed)
+    shape = (nframes, srx.config.ydimension, srx.config.xdimension)
+    return rng.poisson(100, shape).astype(float)
+
+
+@pytest.mark.parametrize("flip, correction", [(None, None), (True, True)])
+def test_integrateStack(srx, flip, correction):
+    stack = make_stack(srx)
+    rv = srx.integrateStack(
+        stack, flip=flip, correction=correction, chunksize=2
+    )
+    assert rv["intensity"].shape == (5, len(rv["xgrid"]))
+    assert rv["uncertainty"].shape == rv["intensity"].shape
+    for image, intensity, uncertainty in zip(
+        stack, rv["intensity"], rv["uncertainty"]
+    ):
+        chi = srx.integrate(
+            np.array(image),
+            savefile=False,
+            flip=flip,
+            correction=correction,
+        )["chi"]
+        assert np.allclose(chi[1], intensity)
+        assert np.allclose(chi[2], uncertainty)
+
+
+def test_integrateStack_memmap(srx, tmp_path):
+    stack = make_stack(srx, nframes=3)
+    filename = str(tmp_path / "stack.npy")
+    np.save(filename, stack)
+    expected = srx.integrateStack(stack)
+    actual = srx.integrateStack(filename)
+    assert np.allclose(expected["intensity"], actual["intensity"])
+
+
+def test_precisionReport(srx):
+    image = make_stack(srx, nframes=1)[0]
+    rv = srx.precisionReport(image, correction=True)
+    assert srx.config.precision == "float64"
+    assert rv["intensity"]["rms"] < 1e-4
+    assert rv["uncertainty"]["rms"] < 1e-4
+
+    srx.updateConfig(precision="float32")
+    srx.prepareCalculation()
+    assert srx.calculate.tthorqmatrix.dtype == np.float32
+    assert srx._getPic(image, correction=True).dtype == np.float32
+
+
+def test_precisionReport_zero(srx):
+    image = np.zeros((srx.config.ydimension, srx.config.xdimension))
+    rv = srx.precisionReport(image)
+    assert rv["intensity"]["maxabs"] == 0
+    assert rv["intensity"]["maxrel"] == 0
+    assert rv["intensity"]["rms"] == 0
+
+
+def test_precisionReport_restore(srx, monkeypatch):
+    integrate = srx.integrate
+
+    def failing(*args, **kwargs):
+        if srx.config.precision == "float32":
+            raise ValueError("float32 failure")
+        return integrate(*args, **kwargs)
+
+    monkeypatch.setattr(srx, "integrate", failing)
+    image = make_stack(srx, nframes=1)[0]
+    with pytest.raises(ValueError):
+        srx.precisionReport(image)
+    assert srx.config.precision == "float64"
+    assert srx.calculate.tthorqmatrix.dtype == np.float64
+
+
+def test_poisson_uncertainty(srx):
+    srx.updateConfig(uncertaintymode="poisson", detectorgain=2.0)
+    stack = make_stack(srx, nframes=2)
+    chi = srx.integrate(stack[0].copy(), savefile=False, correction=True)
+    chi = chi["chi"]
+
+    # variance of corrected counts is raw counts * correction**2 * gain
+    ce = srx.config.cropedges
+    raw = stack[0][ce[2] : -ce[3], ce[0] : -ce[1]]
+    weights = raw * srx.correction**2 * 2.0
+    calculate = srx.calculate
+    nbins = len(calculate.xgrid)
+    variance = np.bincount(
+        calculate.bin_inds, weights.ravel(), minlength=nbins + 1
+    )[:nbins]
+    assert np.allclose(chi[2] ** 2, variance / calculate.bin_number)
+
+    rv = srx.integrateStack(stack, correction=True)
+    assert np.allclose(rv["uncertainty"][0], chi[2])
+    rv = srx.integrateStack(stack)
+    assert np.allclose(rv["uncertainty"] ** 2, rv["intensity"] * 2.0)
+
+
+def test_integrate2D(srx, tmp_path):
+    srx.updateConfig(azimuthstepd=10.0)
+    image = make_stack(srx, nframes=1)[0]
+    rv = srx.integrate2D(image, savename="cake")
+    assert rv["cake"].shape == (36, len(rv["xgrid"]))
+    assert rv["count"].shape == rv["cake"].shape
+
+    # summing over the azimuth gives the 1d pattern
+    chi = srx.integrate(image, savefile=False)["chi"]
+    bin_number = srx.calculate.bin_number
+    covered = rv["count"].sum(axis=0) > 0
+    assert np.array_equal(
+        rv["count"].sum(axis=0)[covered], bin_number[covered]
+    )
+    total = (rv["cake"] * rv["count"]).sum(axis=0)
+    assert np.allclose(total, chi[1] * bin_number)
+
+    saved = np.load(rv["filename"])
+    assert np.array_equal(saved["cake"], rv["cake"])
+
+
+def test_integrateLabels(srx):
+    image = make_stack(srx, nframes=1)[0]
+    shape = image.shape
+    labels = np.zeros(shape, dtype=int)
+    labels[:, 64:] = 1
+    labels[:20] = -1
+    rv = srx.integrateLabels(image, labels)
+    assert rv["intensity"].shape == (2, len(rv["xgrid"]))
+
+    for i in range(2):
+        chi = srx.integrate(image, savefile=False, extramask=labels != i)
+        assert np.allclose(rv["intensity"][i], chi["chi"][1])
+        count = np.maximum(rv["count"][i], 1)
+        assert np.array_equal(count, srx.calculate.bin_number)
+
+    # overlapping regions
+    regions = [labels == 0, labels == 1, labels >= 0]
+    rv2 = srx.integrateLabels(image, regions)
+    assert np.allclose(rv2["intensity"][:2], rv["intensity"])
+    assert np.array_equal(rv2["count"][2], rv["count"].sum(axis=0))
+
+
+def test_integrateStatistics(srx):
+    image = make_stack(srx, nframes=1)[0]
+    rv = srx.integrateStatistics(image)
+    chi = srx.integrate(image, savefile=False)["chi"]
+    assert np.allclose(rv["mean"], chi[1])
+
+    calculate = srx.calculate
+    pixels = calculate.getMaskedmatrixPic(image)[1].ravel()
+    for b in np.flatnonzero(rv["count"])[::5]:
+        values = pixels[calculate.bin_inds == b]
+        assert rv["count"][b] == len(values)
+        assert rv["min"][b] == values.min()
+        assert rv["max"][b] == values.max()
+        assert np.isclose(rv["variance"][b], values.var())
+
+
+@pytest.mark.parametrize("integrationmethod", ["lut", "splitpixel"])
+def test_nthreads(srx, integrationmethod):
+    srx.updateConfig(integrationmethod=integrationmethod)
+    srx.prepareCalculation()
+    image = make_stack(srx, nframes=1)[0]
+    kwargs = {"savefile": False, "correction": True}
+    expected = srx.integrate(image.copy(), **kwargs)["chi"]
+    srx.updateConfig(nthreads=3)
+    actual = srx.integrate(image.copy(), **kwargs)["chi"]
+    assert np.allclose(actual, expected)
+    stack = srx.integrateStack(image[np.newaxis], correction=True)
+    assert np.allclose(stack["uncertainty"][0], expected[2])
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_integrateFilelist_jobs(srx, save_frames, executor):
+    filelist = save_frames(make_stack(srx, nframes=4))
+    expected = srx.integrateFilelist(filelist, correction=True)
+    srx.updateConfig(jobs=2, executor=executor)
+    actual = srx.integrateFilelist(filelist, correction=True)
+    assert [rv["filename"] for rv in actual] == [
+        rv["filename"] for rv in expected
+    ]
+    for rv, rv0 in zip(actual, expected):
+        assert np.allclose(rv["chi"], rv0["chi"])
+        with open(rv["filename"]) as f:
+            lines = f.read().split("#### start data\n")[1].splitlines()
+        assert np.allclose(np.loadtxt(lines).T, rv0["chi"], rtol=1e-5)
+
+
+def test_iterIntegrate(srx, save_frames):
+    filelist = save_frames(make_stack(srx, nframes=4))
+    expected = [srx.integrate(f, savefile=False)["chi"] for f in filelist]
+    for prefetch in [0, 2]:
+        results = srx.iterIntegrate(filelist, prefetch=prefetch)
+        for rv, chi, imagefile in zip(results, expected, filelist):
+            assert np.allclose(rv["chi"], chi)
+            chifile = srx.saveresults.getFilePathWithoutExt(imagefile)
+            assert rv["filename"] == chifile + ".chi"
+
+    # the loading thread stops when the consumer stops early
+    nthreads = threading.active_count()
+    results = srx.iterIntegrate(filelist, prefetch=1)
+    next(results)
+    results.close()
+    assert threading.active_count() == nthreads
+
+    with pytest.raises(FileNotFoundError):
+        list(srx.iterIntegrate(filelist[:1] + ["missing.npy"]))
+
+
+def test_integrate_async(srx, save_frames):
+    filelist = save_frames(make_stack(srx, nframes=4))
+    expected = list(srx.iterIntegrate(filelist))
+
+    async def run():
+        rv = await srx.integrate_async(filelist[0], savefile=False)
+        assert np.allclose(rv["chi"], expected[0]["chi"])
+        results = [rv async for rv in srx.iter_integrate_async(filelist)]
+        # cancelled before it starts
+        task = asyncio.ensure_future(srx.integrate_async(filelist[0]))
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return results
+
+    results = asyncio.run(run())
+    for rv, rv0 in zip(results, expected):
+        assert rv["filename"] == rv0["filename"]
+        assert np.allclose(rv["chi"], rv0["chi"])
+
+
+def test_watch(srx, tmp_path):
+    watchdir = tmp_path / "images"
+    watchdir.mkdir()
+    srx.updateConfig(opendirectory=str(watchdir), includepattern=["*.npy"])
+    stack = make_stack(srx, nframes=3)
+    np.save(watchdir / "frame0.npy", stack[0])
+    (watchdir / "notes.txt").write_text("not an image")
+
+    def write():
+        for i in [1, 2]:
+            time.sleep(0.1)
+            np.save(watchdir / ("frame%d.npy" % i), stack[i])
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    # each file is integrated once
+    rv = srx.watch(interval=0.05, timeout=1.0)
+    writer.join()
+    assert [os.path.basename(r[0]) for r in rv] == [
+        "frame0.npy",
+        "frame1.npy",
+        "frame2.npy",
+    ]
+    for imagefile, chifile, latency in rv:
+        assert latency >= 0
+        chi = srx.integrate(imagefile, savefile=False)["chi"]
+        with open(chifile) as f:
+            lines = f.read().split("#### start data\n")[1].splitlines()
+        assert np.allclose(np.loadtxt(lines).T, chi, rtol=1e-5)
+
+    assert len(srx.watch(interval=0.05, timeout=5.0, maxfiles=1)) == 1
+
+
+def test_watch_error(srx, tmp_path):
+    watchdir = tmp_path / "images"
+    watchdir.mkdir()
+    srx.updateConfig(
+        opendirectory=str(watchdir), includepattern=["*.npy"], readtimeout=0.1
+    )
+    stack = make_stack(srx, nframes=2)
+    np.save(watchdir / "frame0.npy", stack[0])
+    (watchdir / "frame1.npy").write_bytes(b"truncated")
+    np.save(watchdir / "frame2.npy", stack[1])
+    errors = []
+    rv = srx.watch(
+        interval=0.05,
+        timeout=0.5,
+        errorcallback=lambda f, e: errors.append(os.path.basename(f)),
+    )
+    # the bad file is reported once, the other files are integrated
+    assert [os.path.basename(r[0]) for r in rv] == [
+        "frame0.npy",
+        "frame2.npy",
+    ]
+    assert errors == ["frame1.npy"]
+
+
+def test_incremental(srx, save_frames):
+    stack = make_stack(srx, nframes=3)
+    filelist = save_frames(stack)
+    srx.updateConfig(incremental=True)
+    assert len(srx.integrateFilelist(filelist)) == 3
+    assert srx.integrateFilelist(filelist) == []
+
+    # changed file, removed output, then changed config
+    np.save(filelist[1], stack[1] + 1.0)
+    os.remove(srx.saveresults.getFilePathWithoutExt(filelist[2]) + ".chi")
+    rv = srx.integrateFilelist(filelist)
+    assert [os.path.basename(r["filename"]) for r in rv] == [
+        "frame1_twotheta.chi",
+        "frame2_twotheta.chi",
+    ]
+    srx.updateConfig(tthstepd=0.5)
+    assert len(srx.integrateFilelist(filelist)) == 3
+    srx.updateConfig(jobs=2, executor="thread")
+    assert srx.integrateFilelist(filelist) == []
+
+
+def test_summation(srx, save_frames):
+    stack = make_stack(srx, nframes=5)
+    filelist = save_frames(stack, dtype=np.int32)
+    expected = np.mean([srx._getPic(f) for f in filelist], axis=0)
+    # files are decoded into prefetch reused buffers
+    buffers = set()
+    load_image = srx.loadimage.load_image
+
+    def record(filename, out=None):
+        buffers.add(id(out))
+        return load_image(filename, out=out)
+
+    srx.loadimage.load_image = record
+    assert np.allclose(srx._getPic(filelist), expected)
+    assert len(buffers) <= srx.config.prefetch
+    assert id(None) not in buffers
+    rv = srx.integrateFilelist(filelist, summation=True)
+    assert len(rv) == 1
+    assert rv[0]["filename"].endswith("frame4_sum_twotheta.chi")
+
+
+def test_summation_uncertainty(srx, save_frames):
+    srx.updateConfig(uncertaintymode="poisson", detectorgain=2.0)
+    image = make_stack(srx, nframes=1)[0]
+    filelist = save_frames([image] * 4)
+    # the average of identical frames is the frame, with an uncertainty
+    # 1 / sqrt(number of frames) of the uncertainty of one frame
+    chi = srx.integrate(filelist[0], savefile=False)["chi"]
+    for n in [2, 4]:
+        rv = srx.integrateFilelist(filelist[:n], summation=True)[0]["chi"]
+        assert np.allclose(rv[1], chi[1])
+        assert np.allclose(rv[2], chi[2] / np.sqrt(n))
+
+
+@pytest.mark.parametrize("uncertaintymode", ["local", "poisson"])
+def test_accumulate(srx, save_frames, tmp_path, uncertaintymode):
+    srx.updateConfig(uncertaintymode=uncertaintymode)
+    stack = make_stack(srx, nframes=4)
+    filelist = save_frames(stack)
+
+    # same as integrating the average image
+    rv = srx.accumulateFilelist(filelist)
+    assert rv.nframes == 4
+    expected = srx.integrate(filelist, savefile=False)["chi"]
+    assert np.allclose(rv.result()[:2], expected[:2])
+    # variance of the mean of the frames
+    variance = [
+        srx.integrate(f, savefile=False)["chi"][2] ** 2 for f in filelist
+    ]
+    assert np.allclose(rv.result()[2] ** 2, np.mean(variance, axis=0) / 4)
+    # the local gain is estimated from each image
+    assert np.allclose(rv.result()[2], expected[2], rtol=1e-2)
+
+    # partial accumulators merged in any order, also after saving
+    part0 = srx.accumulateFilelist(filelist[:1])
+    part1 = srx.accumulateFilelist(filelist[1:])
+    part1.save(str(tmp_path / "part1.npz"))
+    part1 = IntegrationAccumulator.load(str(tmp_path / "part1.npz"))
+    merged = part1.merge(part0)
+    assert merged.nframes == 4
+    assert np.allclose(merged.result(), rv.result())
+
+    srx.updateConfig(jobs=2)
+    assert np.allclose(srx.accumulateFilelist(filelist).result(), rv.result())
+
+
+def test_bufferpool(srx, save_frames):
+    filelist = save_frames(make_stack(srx, nframes=3), dtype=np.int32)
+    expected = [srx.integrate(f, savefile=False)["chi"] for f in filelist]
+    srx.updateConfig(bufferpool=1, prefetch=1)
+    actual = [srx.integrate(f, savefile=False)["chi"] for f in filelist]
+    actual += [rv["chi"] for rv in srx.iterIntegrate(filelist)]
+    assert srx.bufferpool.size == 3
+    assert len(srx.bufferpool.buffers) <= 3
+    # all buffers are released
+    assert srx.bufferpool.free.qsize() == len(srx.bufferpool.buffers)
+    for chi, chi0 in zip(actual, expected + expected):
+        assert np.allclose(chi, chi0)
+
+
+def test_bufferpool_cancel(srx, save_frames):
+    filelist = save_frames(make_stack(srx, nframes=4))
+    srx.updateConfig(bufferpool=1, prefetch=0, concurrency=2)
+    loadImage = srx._loadImage
+
+    def slowLoad(image):
+        rv = loadImage(image)
+        time.sleep(0.2)
+        return rv
+
+    srx._loadImage = slowLoad
+
+    async def run():
+        tasks = [
+            asyncio.ensure_future(srx.integrate_async(f, savefile=False))
+            for f in filelist
+        ]
+        # cancelled while the images are loaded
+        await asyncio.sleep(0.05)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(0.3)
+        return
+
+    asyncio.run(run())
+    pool = srx.bufferpool
+    assert len(pool.buffers) > 0
+    assert pool.free.qsize() == len(pool.buffers)
+
+
+def test_bufferpool_errors(srx, save_frames, tmp_path):
+    srx.updateConfig(bufferpool=1, readtimeout=0.0)
+    filelist = save_frames(make_stack(srx, nframes=1))
+    size = max(srx.config.prefetch + 2, srx.config.concurrency + 1)
+    badfiles = []
+    for i in range(size + 1):
+        badfiles.append(str(tmp_path / ("bad%d.npy" % i)))
+        with open(badfiles[-1], "wb") as f:
+            f.write(b"truncated")
+    # the buffers of files failing to load are released
+    for badfile in badfiles:
+        with pytest.raises(ValueError):
+            srx.integrate(badfile, savefile=False)
+    with pytest.raises(ValueError):
+        list(srx.iterIntegrate(filelist + badfiles))
+    pool = srx.bufferpool
+    assert pool.free.qsize() == len(pool.buffers)
+    srx.integrate(filelist[0], savefile=False)
+
+
+def test_bufferpool_async(srx, save_frames):
+    filelist = save_frames(make_stack(srx, nframes=4))
+    expected = [srx.integrate(f, savefile=False)["chi"] for f in filelist]
+    srx.updateConfig(bufferpool=1, prefetch=0, concurrency=2)
+    loadImage = srx._loadImage
+
+    def slowLoad(image):
+        # frame 0 is integrated after the other frames are loaded
+        rv = loadImage(image)
+        if image == filelist[0]:
+            time.sleep(0.3)
+        return rv
+
+    srx._loadImage = slowLoad
+
+    async def run():
+        tasks = [srx.integrate_async(f, savefile=False) for f in filelist]
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(run())
+    for rv, chi in zip(results, expected):
+        assert np.allclose(rv["chi"], chi)
@@ -0,0 +1,69 @@
+import threading
+
+import numpy as np
+
+from diffpy.srxplanar.srxplanar import SrXplanar
+from diffpy.srxplanar.workqueue import WorkQueue
+
+
+def test_claim(tmp_path):
+    queuefile = str(tmp_path / "queue.db")
+    queue = WorkQueue(queuefile)
+    assert queue.addFiles(["a", "b", "c"]) == 3
+    assert queue.addFiles(["a", "d"]) == 1
+
+    other = WorkQueue(queuefile)
+    claimed = [queue.claim("w1"), other.claim("w2"), queue.claim("w1")]
+    assert claimed == ["a", "b", "c"]
+    queue.finish("a", "a.chi")
+    other.fail("b", "ValueError: broken")
+    assert queue.counts() == {
+        "pending": 1,
+        "running": 1,
+        "done": 1,
+        "failed": 1,
+    }
+    files = {f["path"]: f for f in queue.files()}
+    assert files["b"]["worker"] == "w2"
+    assert files["a"]["finished"] >= files["a"]["started"]
+
+    # the worker of 'c' died, retry it and the failed file
+    assert queue.requeue(stale=0.0, failed=True) == 2
+    assert queue.requeue(stale=0.0, failed=True, maxattempts=1) == 0
+    assert [f["path"] for f in queue.files("pending")] == ["b", "c", "d"]
+    queue.close()
+    other.close()
+
+
+def test_processQueue(geometry, save_frames, tmp_path):
+    imagedir = tmp_path / "images"
+    imagedir.mkdir()
+    stack = np.random.default_rng(0).poisson(100, (6, 96, 128))
+    save_frames(stack, directory=imagedir)
+    (imagedir / "frame6.npy").write_bytes(b"broken")
+    config = dict(
+        geometry,
+        opendirectory=str(imagedir),
+        includepattern=["*.npy"],
+        savedirectory=str(tmp_path / "save"),
+        queuefile=str(tmp_path / "queue.db"),
+        readtimeout=0.1,
+    )
+
+    def work(worker):
+        SrXplanar(**config).processQueue(worker=worker)
+
+    workers = [
+        threading.Thread(target=work, args=("w%d" % i,)) for i in range(2)
+    ]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    queue = WorkQueue(config["queuefile"])
+    files = queue.files()
+    assert [f["state"] for f in files] == ["done"] * 6 + ["failed"]
+    assert all(f["attempts"] == 1 for f in files)
+    assert len(set(f["output"] for f in files[:6])) == 6
+    queue.close()